@@ -0,0 +1,288 @@
+import operator
+import re
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+
+class Constraint(object):
+    name = None
+
+    def violations(self, series):
+        """
+        flags the values of series that violate the constraint
+        :return: boolean numpy array
+        """
+        return NotImplementedError
+
+
+def _to_comparable(series, value=None):
+    # values of a mistyped column that cannot be converted to the type of value are returned as a mask so they can
+    # be counted as violations
+    if isinstance(value, (datetime, np.datetime64)):
+        converted = pd.to_datetime(series, errors='coerce')
+    else:
+        converted = pd.to_numeric(series, errors='coerce')
+    return converted, (series.notnull() & converted.isnull()).values
+
+
+def _compare(series, compare, value):
+    # null values never violate a range constraint, values that cannot be compared with value always do
+    try:
+        return compare(series, value).values
+    except TypeError:
+        converted, incomparable = _to_comparable(series, value)
+        return compare(converted, value).values | incomparable
+
+
+class NullableConstraint(Constraint):
+    name = 'nullable'
+
+    def violations(self, series):
+        return series.isnull().values
+
+
+class MinConstraint(Constraint):
+    name = 'min'
+
+    def __init__(self, value):
+        self.value = value
+
+    def violations(self, series):
+        return _compare(series, operator.lt, self.value)
+
+
+class MaxConstraint(Constraint):
+    name = 'max'
+
+    def __init__(self, value):
+        self.value = value
+
+    def violations(self, series):
+        return _compare(series, operator.gt, self.value)
+
+
+class AllowedValuesConstraint(Constraint):
+    name = 'allowed_values'
+
+    def __init__(self, values):
+        self.values = list(values)
+
+    def violations(self, series):
+        return (series.notnull() & ~series.isin(self.values)).values
+
+
+class RegexConstraint(Constraint):
+    name = 'regex'
+
+    def __init__(self, pattern):
+        # values must match the whole pattern
+        self.pattern = re.compile(f'(?:{pattern})\\Z')
+
+    def violations(self, series):
+        not_null = series.notnull()
+        matches = series.astype(str).str.match(self.pattern)
+        return (not_null & ~matches).values
+
+
+class UniqueConstraint(Constraint):
+    name = 'unique'
+
+    def violations(self, series):
+        # every repeat of a value after its first occurrence
+        return (series.notnull() & series.duplicated(keep='first')).values
+
+
+class MonotonicConstraint(Constraint):
+    name = 'monotonic'
+
+    def __init__(self, direction='increasing'):
+        if direction not in ['increasing', 'decreasing']:
+            raise ValueError(f"{direction} not in list of admissable directions: ['increasing', 'decreasing']")
+        self.direction = direction
+
+    def violations(self, series, previous=None):
+        try:
+            return self._get_violations(series, previous)
+        except TypeError:
+            converted, incomparable = _to_comparable(series, previous)
+            if previous is not None:
+                previous = _to_comparable(pd.Series([previous]), previous)[0].iloc[0]
+            return self._get_violations(converted, previous) | incomparable
+
+    def _get_violations(self, series, previous=None):
+        # compare every value with the last non-null value before it. previous carries the last non-null value of
+        # the preceding chunk when validating a stream
+        previous_values = series.ffill().shift(1)
+        if previous is not None and not pd.isnull(previous):
+            previous_values = previous_values.fillna(previous)
+        if self.direction == 'increasing':
+            return (series < previous_values).values
+        return (series > previous_values).values
+
+
+class DistinctValueSketch(object):
+    # hyperloglog sketch of the number of distinct values seen, over pandas value hashes. sketches are merged by
+    # taking the register-wise maximum
+
+    def __init__(self, precision=14):
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8)
+
+    @property
+    def relative_error(self):
+        return 1.04 / np.sqrt(len(self.registers))
+
+    def update(self, series):
+        if not len(series):
+            return self
+        hashes = pd.util.hash_pandas_object(series, index=False).values
+        remaining_bits = 64 - self.precision
+        register_indices = (hashes >> np.uint64(remaining_bits)).astype(np.int64)
+        remainders = hashes & np.uint64((1 << remaining_bits) - 1)
+        # position of the leftmost set bit in the remaining bits, remainders below 2 ** 53 convert to float exactly
+        _, exponents = np.frexp(remainders.astype(np.float64))
+        ranks = np.where(remainders == 0, remaining_bits + 1, remaining_bits - exponents + 1).astype(np.uint8)
+        np.maximum.at(self.registers, register_indices, ranks)
+        return self
+
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise ValueError('can only merge sketches of equal precision')
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    def estimate(self):
+        n_registers = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / n_registers)
+        raw_estimate = alpha * n_registers ** 2 / np.sum(np.ldexp(1.0, -self.registers.astype(np.int64)))
+        n_empty = np.count_nonzero(self.registers == 0)
+        if raw_estimate <= 2.5 * n_registers and n_empty:
+            # linear counting for small cardinalities
+            return n_registers * np.log(n_registers / n_empty)
+        return raw_estimate
+
+
+def compile_schema(schema):
+    # translate the constraint keys of each column specification into constraint objects, once per schema
+    compiled_schema = {}
+    for column_name, specification in schema.items():
+        constraints = []
+        if specification.get('nullable') is False:
+            constraints.append(NullableConstraint())
+        if specification.get('min') is not None:
+            constraints.append(MinConstraint(specification['min']))
+        if specification.get('max') is not None:
+            constraints.append(MaxConstraint(specification['max']))
+        if specification.get('allowed_values') is not None:
+            constraints.append(AllowedValuesConstraint(specification['allowed_values']))
+        if specification.get('regex') is not None:
+            constraints.append(RegexConstraint(specification['regex']))
+        if specification.get('unique'):
+            constraints.append(UniqueConstraint())
+        if specification.get('monotonic'):
+            constraints.append(MonotonicConstraint(specification['monotonic']))
+        if constraints:
+            compiled_schema[column_name] = constraints
+    return compiled_schema
+
+
+def _summarize_violations(violations, index, sample_size, block_size=65536):
+    # violation count and the index labels of the first sample_size violations. positions are only taken from
+    # leading blocks of the mask until the sample is full, instead of for every violation of the column
+    violation_count = int(np.count_nonzero(violations))
+    if not violation_count:
+        return None
+    positions = []
+    for start in range(0, len(violations), block_size):
+        positions.extend((np.flatnonzero(violations[start:start + block_size]) + start)[:sample_size - len(positions)])
+        if len(positions) >= min(sample_size, violation_count):
+            break
+    return {'violation_count': violation_count, 'sample_indices': index[positions].tolist()}
+
+
+def evaluate_constraints(series, constraints, sample_size=5):
+    # violation count and the index labels of the first sample_size offending rows for each violated constraint
+    result = {}
+    for constraint in constraints:
+        summary = _summarize_violations(constraint.violations(series), series.index, sample_size)
+        if summary:
+            result[constraint.name] = summary
+    return result
+
+
+class StreamingConstraintEvaluator(object):
+    # evaluates compiled constraints chunk by chunk and merges the results: counts add up, sample indices are kept
+    # up to sample_size and monotonic checks carry the last value of the previous chunk. unique violations are
+    # reported as a lower bound, with an estimate of duplicates across chunks from a distinct-value sketch per column
+
+    def __init__(self, compiled_schema, sample_size=5, sketch_precision=14):
+        self.compiled_schema = compiled_schema
+        self.sample_size = sample_size
+        self.sketch_precision = sketch_precision
+        self.violation_dict = {}
+        self.last_values = {}
+        self.sketches = {}
+        self.non_null_counts = {}
+
+    def update(self, chunk, executor=None):
+        columns = [column for column in self.compiled_schema if column in chunk.columns]
+        mapper = executor.map if executor is not None else map
+        for column, result in mapper(lambda column: (column, self._update_column(column, chunk[column])), columns):
+            self._merge(column, result)
+        return self
+
+    def result(self):
+        violation_dict = {
+            column: {name: dict(entry) for name, entry in column_result.items()}
+            for column, column_result in self.violation_dict.items()
+        }
+        for column, sketch in self.sketches.items():
+            # duplicates within chunks are counted exactly, duplicates across chunks only show through the sketch,
+            # so the streamed count is a lower bound for every unique column, including ones with no violations
+            entry = violation_dict.setdefault(column, {}).setdefault(
+                UniqueConstraint.name, {'violation_count': 0, 'sample_indices': []}
+            )
+            entry['lower_bound'] = True
+            distinct_estimate = sketch.estimate()
+            duplicate_estimate = self.non_null_counts[column] - distinct_estimate
+            # the estimate is only trusted beyond three standard errors of the sketch
+            if duplicate_estimate > 3 * sketch.relative_error * distinct_estimate:
+                entry['estimated_violation_count'] = max(entry['violation_count'], int(round(duplicate_estimate)))
+            else:
+                entry['estimated_violation_count'] = entry['violation_count']
+        return violation_dict
+
+    def _update_column(self, column, series):
+        result = {}
+        for constraint in self.compiled_schema[column]:
+            if isinstance(constraint, MonotonicConstraint):
+                violations = constraint.violations(series, previous=self.last_values.get(column))
+                last_valid_index = series.last_valid_index()
+                if last_valid_index is not None:
+                    self.last_values[column] = series.loc[last_valid_index]
+            elif isinstance(constraint, UniqueConstraint):
+                # duplicates within the chunk are exact, duplicates across chunks go through the sketch
+                violations = constraint.violations(series)
+                non_null = series.dropna()
+                self.sketches.setdefault(column, DistinctValueSketch(self.sketch_precision)).update(non_null)
+                self.non_null_counts[column] = self.non_null_counts.get(column, 0) + len(non_null)
+            else:
+                violations = constraint.violations(series)
+            summary = _summarize_violations(violations, series.index, self.sample_size)
+            if summary:
+                result[constraint.name] = summary
+        return result
+
+    def _merge(self, column, result):
+        column_result = self.violation_dict.setdefault(column, {})
+        for name, entry in result.items():
+            if name not in column_result:
+                column_result[name] = entry
+                continue
+            column_result[name]['violation_count'] += entry['violation_count']
+            sample_indices = column_result[name]['sample_indices']
+            sample_indices.extend(entry['sample_indices'][:self.sample_size - len(sample_indices)])
+        if not column_result:
+            del self.violation_dict[column]
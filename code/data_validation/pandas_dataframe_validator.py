@@ -1,9 +1,12 @@
 import logging
+from concurrent.futures import ThreadPoolExecutor
 logging.basicConfig(level=logging.INFO)
 
 import pandas as pd
+import pyarrow.parquet as pq
 
 from data_validation.base import Validator
+from data_validation.constraints import compile_schema, evaluate_constraints, StreamingConstraintEvaluator
 
 
 class PandasDataFrameValidator(Validator):
@@ -20,7 +23,8 @@ class PandasDataFrameValidator(Validator):
         }
         self.validation_result = {}
 
-    def validate(self, schema, data):
+    def validate(self, schema, data, n_jobs=None, sample_size=5):
+        self.validation_result = {}
         # ensure appropriate schema structure
         self._check_schema_structure(schema)
         # get specified columns and check for any missing
@@ -28,8 +32,77 @@ class PandasDataFrameValidator(Validator):
         self._check_missing_columns(required_columns, data)
         self._check_unspecified_columns(required_columns, data)
         self._check_data_types(schema, data)
+        self._check_constraints(compile_schema(schema), data, n_jobs=n_jobs, sample_size=sample_size)
         return self.validation_result
 
+    def validate_chunks(self, schema, chunks, n_jobs=None, sample_size=5, sketch_precision=14):
+        # validate an iterator of dataframe chunks, holding one chunk in memory at a time. chunk index labels are
+        # reported as sample indices, so chunks should keep their row positions as index
+        self.validation_result = {}
+        self._check_schema_structure(schema)
+        required_columns = list(schema.keys())
+        evaluator = StreamingConstraintEvaluator(
+            compile_schema(schema), sample_size=sample_size, sketch_precision=sketch_precision
+        )
+        missing_columns, unspecified_columns = set(), set()
+        incorrect_dtype_dict, observed_dtypes = {}, {}
+        executor = ThreadPoolExecutor(max_workers=n_jobs) if n_jobs and n_jobs > 1 else None
+        try:
+            for chunk in chunks:
+                missing_columns.update(set(required_columns) - set(chunk.columns))
+                unspecified_columns.update(set(chunk.columns) - set(required_columns))
+                for column, incorrect_dtype in self._get_incorrect_data_types(schema, chunk).items():
+                    incorrect_dtype_dict.setdefault(column, incorrect_dtype)
+                for column, dtype in chunk.dtypes.items():
+                    observed_dtypes.setdefault(column, set()).add(str(dtype))
+                evaluator.update(chunk, executor=executor)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        if missing_columns:
+            logging.info(f'missing columns: {list(missing_columns)}')
+            self.validation_result['missing_column_list'] = list(missing_columns)
+        if unspecified_columns:
+            logging.info(f'unspecified columns: {list(unspecified_columns)}')
+            self.validation_result['unspecified_column_list'] = list(unspecified_columns)
+        if incorrect_dtype_dict:
+            logging.info(f'incorrect column types: {list(incorrect_dtype_dict.keys())}')
+            self.validation_result['incorrect_dtype_dict'] = incorrect_dtype_dict
+        inconsistent_dtype_dict = {
+            column: sorted(dtypes) for column, dtypes in observed_dtypes.items() if len(dtypes) > 1
+        }
+        if inconsistent_dtype_dict:
+            logging.info(f'inconsistent column types across chunks: {list(inconsistent_dtype_dict.keys())}')
+            self.validation_result['inconsistent_dtype_dict'] = inconsistent_dtype_dict
+        constraint_violation_dict = evaluator.result()
+        if constraint_violation_dict:
+            logging.info(f'constraint violations: {list(constraint_violation_dict.keys())}')
+            if evaluator.sketches:
+                # duplicates across chunks are only estimated, see lower_bound and estimated_violation_count
+                logging.info('unique violation counts of a chunked validation are lower bounds')
+            self.validation_result['constraint_violation_dict'] = constraint_violation_dict
+        return self.validation_result
+
+    def validate_csv(self, schema, path, chunksize=100000, compression='infer', n_jobs=None, sample_size=5,
+                     **read_csv_kwargs):
+        # stream a (gzipped) csv file, such as an airbnb snapshot file, through validate_chunks
+        chunks = pd.read_csv(path, chunksize=chunksize, compression=compression, **read_csv_kwargs)
+        return self.validate_chunks(schema, chunks, n_jobs=n_jobs, sample_size=sample_size)
+
+    def validate_parquet(self, schema, path, batch_size=100000, n_jobs=None, sample_size=5):
+        # stream a parquet file through validate_chunks. chunks keep their row positions in the file as index
+        def iter_chunks():
+            parquet_file = pq.ParquetFile(path)
+            offset = 0
+            for batch in parquet_file.iter_batches(batch_size=batch_size):
+                chunk = batch.to_pandas()
+                chunk.index = pd.RangeIndex(offset, offset + len(chunk))
+                offset += len(chunk)
+                yield chunk
+
+        return self.validate_chunks(schema, iter_chunks(), n_jobs=n_jobs, sample_size=sample_size)
+
     def coerce_data_types(self, schema, data):
         type_mapping_dict = {
             'boolean': 'bool',
@@ -53,6 +126,12 @@ class PandasDataFrameValidator(Validator):
         return df_corrected_types
 
     def _check_data_types(self, schema, data):
+        incorrect_dtype_dict = self._get_incorrect_data_types(schema, data)
+        if incorrect_dtype_dict:
+            logging.info(f'incorrect column types: {list(incorrect_dtype_dict.keys())}')
+            self.validation_result['incorrect_dtype_dict'] = incorrect_dtype_dict
+
+    def _get_incorrect_data_types(self, schema, data):
         actual_dtypes = {
             column_name: dtype.type for column_name, dtype in data.dtypes.to_dict().items()
         }
@@ -65,9 +144,25 @@ class PandasDataFrameValidator(Validator):
                         'specified_column_type': schema[column]['type'],
                         'actual_column_type': actual_dtypes[column]
                     }
-        if incorrect_dtype_dict:
-            logging.info(f'incorrect column types: {list(incorrect_dtype_dict.keys())}')
-            self.validation_result['incorrect_dtype_dict'] = incorrect_dtype_dict
+        return incorrect_dtype_dict
+
+    def _check_constraints(self, compiled_schema, data, n_jobs=None, sample_size=5):
+        # constraint checks of each column are evaluated together, columns in a thread pool when n_jobs is set
+        columns = [column for column in compiled_schema if column in data.columns]
+
+        def check_column(column):
+            return column, evaluate_constraints(data[column], compiled_schema[column], sample_size=sample_size)
+
+        if n_jobs and n_jobs > 1:
+            with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+                results = list(executor.map(check_column, columns))
+        else:
+            results = [check_column(column) for column in columns]
+
+        constraint_violation_dict = {column: result for column, result in results if result}
+        if constraint_violation_dict:
+            logging.info(f'constraint violations: {list(constraint_violation_dict.keys())}')
+            self.validation_result['constraint_violation_dict'] = constraint_violation_dict
 
     def _check_missing_columns(self, required_columns, dataframe):
         missing_columns_list = list(set(required_columns) - set(dataframe.columns))
@@ -91,6 +186,7 @@ class PandasDataFrameValidator(Validator):
                 raise ValueError(
                     f'{_type} not in list of admissable fields: {list(self.admissable_data_types.keys())}'
                 )
+            elif specification.get('monotonic') not in [None, False, 'increasing', 'decreasing']:
+                raise ValueError('monotonic must be one of: [\'increasing\', \'decreasing\']')
             else:
                 pass
-    # TODO: add in constraint validation for each admissable data type -  ex. nullable or not, range of values, ect.
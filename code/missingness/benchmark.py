@@ -0,0 +1,95 @@
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from missingness.missingness_transformer import MissingnessTransformer
+
+
+STRATEGIES = ['univariate_mean', 'multivariate_linear', 'multivariate_tree', 'multivariate_knn']
+
+
+def generate_missing_data(num_rows, num_columns, missing_rate=0.1, mechanism='MCAR', random_state=0):
+    # correlated gaussian columns, so multivariate imputers have signal to exploit, with values removed either
+    # completely at random (MCAR) or depending on the always observed first column (MAR)
+    if mechanism not in ['MCAR', 'MAR']:
+        raise ValueError(f'{mechanism} not in list of admissable mechanisms: [\'MCAR\', \'MAR\']')
+    rng = np.random.RandomState(random_state)
+    latent = rng.normal(size=(num_rows, max(2, num_columns // 4)))
+    loadings = rng.normal(size=(latent.shape[1], num_columns))
+    complete = latent.dot(loadings) + 0.5 * rng.normal(size=(num_rows, num_columns))
+    columns = [f'x{column}' for column in range(num_columns)]
+    df_complete = pd.DataFrame(complete, columns=columns)
+
+    if mechanism == 'MCAR':
+        missing_probability = np.full((num_rows, num_columns), missing_rate)
+    else:
+        driver = (complete[:, 0] - complete[:, 0].mean()) / complete[:, 0].std()
+        # sigmoid averages to 0.5, so the overall missing rate stays close to missing_rate
+        missing_probability = np.clip(2 * missing_rate / (1 + np.exp(-2 * driver)), 0, 1)[:, None]
+        missing_probability = np.repeat(missing_probability, num_columns, axis=1)
+    missing_mask = rng.uniform(size=(num_rows, num_columns)) < missing_probability
+    # the first column is always observed so every row keeps some information
+    missing_mask[:, 0] = False
+    return df_complete, df_complete.mask(missing_mask), missing_mask
+
+
+def _fit_transform(strategy, df_missing, n_jobs=None):
+    transformer = MissingnessTransformer(config={f'impute_{strategy}': df_missing.columns.tolist()}, n_jobs=n_jobs)
+    start = time.perf_counter()
+    transformer.fit(df_missing)
+    fit_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    df_imputed = transformer.transform(df_missing)
+    transform_seconds = time.perf_counter() - start
+    return df_imputed, fit_seconds, transform_seconds
+
+
+def benchmark_strategy(strategy, df_complete, df_missing, missing_mask, n_jobs=None):
+    # time and peak memory come from separate runs, since tracemalloc slows down allocation-heavy strategies more
+    # than others
+    df_imputed, fit_seconds, transform_seconds = _fit_transform(strategy, df_missing, n_jobs=n_jobs)
+
+    tracemalloc.start()
+    _fit_transform(strategy, df_missing, n_jobs=n_jobs)
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    errors = df_imputed[df_complete.columns].values[missing_mask] - df_complete.values[missing_mask]
+    return {
+        'strategy': strategy,
+        'fit_seconds': fit_seconds,
+        'transform_seconds': transform_seconds,
+        'peak_memory_mb': peak_memory / 2 ** 20,
+        'rmse': np.sqrt(np.mean(errors ** 2))
+    }
+
+
+def run_benchmark(sizes=((1000, 10), (10000, 20)), strategies=STRATEGIES, missing_rate=0.1,
+                  mechanisms=('MCAR', 'MAR'), n_jobs=None, random_state=0):
+    results = []
+    for num_rows, num_columns in sizes:
+        for mechanism in mechanisms:
+            df_complete, df_missing, missing_mask = generate_missing_data(
+                num_rows, num_columns, missing_rate=missing_rate, mechanism=mechanism, random_state=random_state
+            )
+            for strategy in strategies:
+                result = benchmark_strategy(strategy, df_complete, df_missing, missing_mask, n_jobs=n_jobs)
+                result.update({'num_rows': num_rows, 'num_columns': num_columns, 'mechanism': mechanism})
+                results.append(result)
+    return pd.DataFrame(results)
+
+
+def select_strategy(df_results, max_rmse):
+    # cheapest strategy (fit plus transform time) whose rmse meets the accuracy target for every size
+    df_summary = df_results.groupby('strategy').agg({'fit_seconds': 'sum', 'transform_seconds': 'sum', 'rmse': 'max'})
+    df_summary = df_summary[df_summary['rmse'] <= max_rmse]
+    if df_summary.empty:
+        return None
+    return (df_summary['fit_seconds'] + df_summary['transform_seconds']).idxmin()
+
+
+if __name__ == '__main__':
+    df_results = run_benchmark()
+    print(df_results.to_string(index=False))
@@ -1,27 +1,95 @@
+import logging
 
+import numpy as np
+import pandas as pd
 
-def drop_dataframe_values_by_threshold(dataframe, axis=1, threshold=0.75):
-    # select axis to calculate percent of missing values
-    mask_axis = 1 if axis == 0 else 0
-    # boolean mask to filter dataframe based on threshold
-    mask = (
-            (dataframe.isnull().sum(axis=mask_axis) / dataframe.shape[mask_axis]) < threshold
-    ).values
+logging.basicConfig(level=logging.INFO)
+
+
+# number of set bits in every possible byte, used to count nulls straight from the packed mask
+_POPCOUNT_TABLE = np.array([bin(value).count('1') for value in range(256)], dtype=np.uint8)
+
+
+class MissingnessProfile(object):
+    # null mask of a dataframe computed once in row blocks and stored bit-packed (one bit per cell), with
+    # per-column and per-row null counts accumulated in the same pass
+
+    def __init__(self, dataframe, block_size=100000):
+        self.columns = dataframe.columns
+        self.num_rows, self.num_columns = dataframe.shape
+        self.packed_mask = np.empty((self.num_rows, (self.num_columns + 7) // 8), dtype=np.uint8)
+        self.column_null_counts = np.zeros(self.num_columns, dtype=np.int64)
+        self.row_null_counts = np.empty(self.num_rows, dtype=np.int64)
+
+        for start in range(0, self.num_rows, block_size):
+            block = dataframe.iloc[start:start + block_size].isnull().values
+            end = start + block.shape[0]
+            self.column_null_counts += block.sum(axis=0)
+            self.row_null_counts[start:end] = block.sum(axis=1)
+            self.packed_mask[start:end] = np.packbits(block, axis=1)
+
+    def column_missing_rate(self):
+        return pd.Series(self.column_null_counts / max(self.num_rows, 1), index=self.columns)
+
+    def row_missing_rate(self, columns=None):
+        # missing rate of each row over the given subset of columns (all columns by default)
+        if columns is None:
+            return self.row_null_counts / max(self.num_columns, 1)
+        column_mask = self.columns.isin(columns)
+        excluded_bits = np.packbits(~column_mask)
+        excluded_counts = _POPCOUNT_TABLE[self.packed_mask & excluded_bits].sum(axis=1)
+        return (self.row_null_counts - excluded_counts) / max(column_mask.sum(), 1)
+
+    def column_mask(self, threshold):
+        # True for columns to keep, i.e. with a missing rate below threshold
+        return self.column_missing_rate().values < threshold
+
+    def row_mask(self, threshold, columns=None):
+        # True for rows to keep, with the missing rate measured over columns
+        return self.row_missing_rate(columns) < threshold
+
+    def missingness_patterns(self, top=None):
+        # count of rows sharing each combination of missing columns, most frequent first
+        row_bytes = np.ascontiguousarray(self.packed_mask).view(np.dtype((np.void, self.packed_mask.shape[1])))
+        patterns, counts = np.unique(row_bytes.ravel(), return_counts=True)
+        pattern_mask = np.unpackbits(
+            patterns.view(np.uint8).reshape(len(patterns), -1), axis=1
+        )[:, :self.num_columns].astype(bool)
+        df_patterns = pd.DataFrame(pattern_mask, columns=self.columns)
+        df_patterns['count'] = counts
+        df_patterns = df_patterns.sort_values('count', ascending=False).reset_index(drop=True)
+        if top:
+            return df_patterns.head(top)
+        return df_patterns
+
+
+def drop_dataframe_values_by_threshold(dataframe, axis=1, threshold=0.75, reset_index=True, profile=None):
+    # a profile computed on the full dataframe can be passed in and reused for both axes
+    if profile is None:
+        profile = MissingnessProfile(dataframe)
 
     if axis == 1:
+        # boolean mask to filter dataframe based on threshold
+        mask = profile.column_mask(threshold)
         # get columns to drop for logging
-        columns_to_drop = dataframe.columns[~mask].values.tolist()
+        columns_to_drop = profile.columns[~mask].values.tolist()
         if len(columns_to_drop) > 0:
-            print(f'dropping columns: {columns_to_drop}')
+            logging.info(f'dropping columns: {columns_to_drop}')
         # filter dataframe and reset index
-        dataframe = dataframe.loc[:, mask].reset_index(drop=True)
+        dataframe = dataframe.loc[:, profile.columns[mask]]
+        if reset_index:
+            dataframe = dataframe.reset_index(drop=True)
     else:
         num_rows_original = dataframe.shape[0]
+        # row missing rate over the columns still in the dataframe
+        mask = profile.row_mask(threshold, columns=dataframe.columns)
         # filter dataframe and reset index
-        dataframe = dataframe.loc[mask, :].reset_index(drop=True)
+        dataframe = dataframe.loc[mask, :]
+        if reset_index:
+            dataframe = dataframe.reset_index(drop=True)
         # calculate number of rows that are being dropped for logging
         num_rows_to_drop = num_rows_original - dataframe.shape[0]
-        pct_dropped = round((num_rows_to_drop / num_rows_original) * 100, 1)
-        print(f'dropping rows: {num_rows_to_drop} ({pct_dropped}%)')
+        pct_dropped = round((num_rows_to_drop / num_rows_original) * 100, 1) if num_rows_original else 0.0
+        logging.info(f'dropping rows: {num_rows_to_drop} ({pct_dropped}%)')
 
     return dataframe
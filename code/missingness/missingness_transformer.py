@@ -1,91 +1,196 @@
+import time
+
+import joblib
+import numpy as np
 import pandas as pd
+import pyarrow.parquet as pq
+from joblib import Parallel, delayed
 
 from sklearn.base import BaseEstimator, TransformerMixin
-from sklearn.compose import ColumnTransformer
 from sklearn.ensemble import ExtraTreesRegressor
+from sklearn.exceptions import NotFittedError
 from sklearn.experimental import enable_iterative_imputer
 from sklearn.impute import SimpleImputer, IterativeImputer
 from sklearn.linear_model import BayesianRidge
 from sklearn.neighbors import KNeighborsRegressor
 from sklearn.pipeline import Pipeline
 
-from missingness.utils import drop_dataframe_values_by_threshold
+from missingness.helpers import MissingnessProfile, drop_dataframe_values_by_threshold
+
+
+def _fit_imputer(transformer, X):
+    start = time.perf_counter()
+    transformer.fit(X)
+    return transformer, time.perf_counter() - start
+
+
+def _transform_imputer(transformer, X):
+    start = time.perf_counter()
+    X_imputed = transformer.transform(X)
+    return X_imputed, time.perf_counter() - start
 
 
 class MissingnessTransformer(BaseEstimator, TransformerMixin):
-    def __init__(self, config=None, return_missing_indicators=False):
+    def __init__(self, config=None, return_missing_indicators=False, n_jobs=None):
         if config:
             self.config = config
         else:
             self.config = {}
         self.random_state = 0
         self.return_missing_indicators = return_missing_indicators
+        # n_jobs runs the imputers for each config key in a process pool and is passed on to the estimators
+        self.n_jobs = n_jobs
         self.estimator_dict = {
             'linear': BayesianRidge(),
-            'tree': ExtraTreesRegressor(n_estimators=50, random_state=self.random_state),
-            'knn': KNeighborsRegressor(n_neighbors=15)
+            'tree': ExtraTreesRegressor(n_estimators=50, random_state=self.random_state, n_jobs=n_jobs),
+            'knn': KNeighborsRegressor(n_neighbors=15, n_jobs=n_jobs)
         }
-        self.missing_data_transformer = None
+        self.imputers = None
+        self.retained_columns = None
+        self.imputed_columns = None
+        self.imputer_timings = {}
 
     def fit(self, X, y=None):
+        # column drops and imputers are learned here once and reused by every transform call.
+        # one null-mask profile serves both the column and the row drop
+        profile = MissingnessProfile(X) if 'delete_threshold_list' in self.config else None
+        X = self._drop_columns(X, profile=profile)
+        self.retained_columns = X.columns.tolist()
+        X = self._drop_rows(X, profile=profile)
+
+        self.imputers = None
+        self.imputed_columns = []
+        self.imputer_timings = {}
+        impute_keys_list = [key for key in self.config if key.startswith('impute_')]
+        if len(impute_keys_list) > 0:
+            imputer_list = self._build_imputers(impute_keys_list)
+            # each column group is fitted independently, so the groups run concurrently
+            results = Parallel(n_jobs=self.n_jobs, prefer='processes')(
+                delayed(_fit_imputer)(transformer, X[columns]) for _, transformer, columns in imputer_list
+            )
+            self.imputers = []
+            for (impute_key, _, columns), (transformer, seconds) in zip(imputer_list, results):
+                self.imputers.append((impute_key, transformer, columns))
+                self.imputer_timings[impute_key] = {
+                    'num_columns': len(columns), 'fit_seconds': seconds, 'transform_seconds': None
+                }
+                self.imputed_columns += columns
         return self
 
     def transform(self, X, y=None):
+        return self._transform_frame(X, copy=True)
+
+    def transform_chunks(self, chunks):
+        # apply the fitted transformer to an iterator of dataframe chunks, imputing each chunk in place
+        for chunk in chunks:
+            yield self._transform_frame(chunk, copy=False)
+
+    def transform_parquet(self, path, batch_size=100000):
+        # stream a parquet file through the fitted transformer, reading only the retained columns. chunks keep
+        # their row positions in the file as index
+        if self.retained_columns is None:
+            raise NotFittedError('MissingnessTransformer must be fitted before calling transform')
+        parquet_file = pq.ParquetFile(path)
+        offset = 0
+        for batch in parquet_file.iter_batches(batch_size=batch_size, columns=self.retained_columns):
+            chunk = batch.to_pandas()
+            chunk.index = pd.RangeIndex(offset, offset + len(chunk))
+            offset += len(chunk)
+            yield self._transform_frame(chunk, copy=False)
+
+    def _transform_frame(self, X, copy=True):
+        if self.retained_columns is None:
+            raise NotFittedError('MissingnessTransformer must be fitted before calling transform')
+        if copy or X.columns.tolist() != self.retained_columns:
+            X = X[self.retained_columns]
+        if X.empty:
+            # an empty chunk, e.g. the last one of a stream, has nothing to drop or impute
+            return X
+        X = self._drop_rows(X, reset_index=False)
+        if X.empty:
+            # every row of the chunk was dropped, there is nothing to impute
+            return X
+
+        if self.imputers is not None:
+            results = Parallel(n_jobs=self.n_jobs, prefer='processes')(
+                delayed(_transform_imputer)(transformer, X[columns]) for _, transformer, columns in self.imputers
+            )
+            for (impute_key, _, _), (_, seconds) in zip(self.imputers, results):
+                self.imputer_timings[impute_key]['transform_seconds'] = seconds
+            # write the imputed values back into their columns instead of concatenating a second frame,
+            # which keeps the original column order and index
+            with pd.option_context('mode.chained_assignment', None):
+                X[self.imputed_columns] = np.hstack([X_imputed for X_imputed, _ in results])
+
+        return X
+
+    def timing_report(self):
+        # seconds spent by each imputer in fit and in the last transform call, slowest first
+        columns = ['num_columns', 'fit_seconds', 'transform_seconds']
+        if not self.imputer_timings:
+            return pd.DataFrame(columns=columns)
+        return pd.DataFrame.from_dict(self.imputer_timings, orient='index')[columns].sort_values(
+            'fit_seconds', ascending=False
+        )
+
+    def save(self, path):
+        joblib.dump(self, path)
+
+    @classmethod
+    def load(cls, path):
+        # load a pre-fitted transformer, e.g. in a scoring service that only calls transform
+        transformer = joblib.load(path)
+        if not isinstance(transformer, cls):
+            raise TypeError(f'{path} does not contain a {cls.__name__}')
+        return transformer
+
+    def _drop_columns(self, X, profile=None):
         if 'delete_threshold_list' in self.config:
             if 'delete_column_threshold' in self.config:
                 X = drop_dataframe_values_by_threshold(
                     X,
                     axis=1,
-                    threshold=self.config['delete_column_threshold']
+                    threshold=self.config['delete_column_threshold'],
+                    reset_index=False,
+                    profile=profile
                 )
+        return X
 
+    def _drop_rows(self, X, reset_index=True, profile=None):
+        if 'delete_threshold_list' in self.config:
             if 'delete_row_threshold' in self.config:
                 X = drop_dataframe_values_by_threshold(
                     X,
                     axis=0,
-                    threshold=self.config['delete_row_threshold']
+                    threshold=self.config['delete_row_threshold'],
+                    reset_index=reset_index,
+                    profile=profile
                 )
+        return X
 
-        impute_keys_list = [key for key in self.config if key.startswith('impute_')]
+    def _build_imputers(self, impute_keys_list):
+        transformer_list = []
+        for impute_key in impute_keys_list:
+            impute_type = impute_key.split('_')[1]
+            impute_strategy = impute_key.split('_')[2]
+            fill_value = None
 
-        if len(impute_keys_list) > 0:
-            column_names = []
-            transformer_list = []
-            for impute_key in impute_keys_list:
-                impute_type = impute_key.split('_')[1]
-                impute_strategy = impute_key.split('_')[2]
-                fill_value = None
-
-                if impute_type == 'univariate':
-                    # following strategies are admissable [“mean”, “median”, “most_frequent”, or “constant”]
-                    if impute_strategy == 'constant':
-                        try:
-                            fill_value = float(impute_key.split('_')[3])
-                        except:
-                            fill_value = impute_key.split('_')[3]
-                    imputer = SimpleImputer(strategy=impute_strategy, fill_value=fill_value)
-
-                if impute_type == 'multivariate':
-                    # following estimators are admissable ['linear', 'tree', '']
-                    impute_estimator = self.estimator_dict[impute_strategy]
-                    imputer = IterativeImputer(estimator=impute_estimator, random_state=self.random_state)
-
-                transformer = Pipeline(steps=[('imputer', imputer)])
-                transformer_list.append(
-                    (impute_key, transformer, self.config[impute_key])
-                )
-                column_names += self.config[impute_key]
-            # combine all imputers
-            missing_data_transformer = ColumnTransformer(transformers=transformer_list)
-            missing_data_transformer.fit(X)
-            self.missing_data_transformer = missing_data_transformer
-            X_transformed = pd.concat(
-                [
-                    pd.DataFrame(missing_data_transformer.transform(X), columns=column_names),
-                    X[[column for column in X.columns if column not in column_names]]
-                ],
-                axis=1
-            )
-            return X_transformed
+            if impute_type == 'univariate':
+                # following strategies are admissable [“mean”, “median”, “most_frequent”, or “constant”]
+                if impute_strategy == 'constant':
+                    try:
+                        fill_value = float(impute_key.split('_')[3])
+                    except:
+                        fill_value = impute_key.split('_')[3]
+                imputer = SimpleImputer(strategy=impute_strategy, fill_value=fill_value)
+
+            if impute_type == 'multivariate':
+                # following estimators are admissable ['linear', 'tree', '']
+                impute_estimator = self.estimator_dict[impute_strategy]
+                imputer = IterativeImputer(estimator=impute_estimator, random_state=self.random_state)
 
-        return X
\ No newline at end of file
+            transformer = Pipeline(steps=[('imputer', imputer)])
+            transformer_list.append(
+                (impute_key, transformer, self.config[impute_key])
+            )
+        return transformer_list
@@ -1,30 +1,102 @@
 import gzip
-import itertools
 import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from functools import partial
 from io import BytesIO
-from operator import itemgetter
 
+import numpy as np
 import pandas as pd
-from urllib.request import urlopen
 
 import requests
+from requests.adapters import HTTPAdapter
 from bs4 import BeautifulSoup
 from tqdm import tqdm
 
-from utils.datetime_utils.time_wrapper import timefunc
+from scraping.collector import SnapshotCollector
+from scraping.sinks import MongoDBSink
+from scraping.snapshot_cache import SnapshotCache, SnapshotManifest
 
-from utils.database_utils.mongodb_handler import MongoDBHandler
+from utils.datetime_utils.time_wrapper import timefunc
 
 logging.basicConfig(level=logging.INFO)
 
 
 class AirBnBScraper(object):
     BASE_URL = 'http://insideairbnb.com/get-the-data.html'
+    FILE_FAMILIES = 3
+    RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+    RETRY_EXCEPTIONS = (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError)
+    # explicit dtypes for the columns we rely on so the parser does not infer them per file
+    FILE_DTYPES = {
+        'listings': {
+            'id': 'int64',
+            'host_id': 'int64',
+            'name': 'object',
+            'host_name': 'object',
+            'last_scraped': 'object',
+            'neighbourhood_cleansed': 'object',
+            'neighbourhood_group_cleansed': 'object',
+            'latitude': 'float64',
+            'longitude': 'float64',
+            'room_type': 'object',
+            'price': 'object',
+            'minimum_nights': 'float64',
+            'maximum_nights': 'float64',
+            'number_of_reviews': 'float64',
+            'last_review': 'object',
+            'reviews_per_month': 'float64',
+            'availability_365': 'float64',
+        },
+        'reviews': {
+            'listing_id': 'int64',
+            'id': 'int64',
+            'date': 'object',
+            'reviewer_id': 'int64',
+            'reviewer_name': 'object',
+            'comments': 'object',
+        },
+        'calendars': {
+            'listing_id': 'int64',
+            'date': 'object',
+            'available': 'object',
+            'price': 'object',
+            'adjusted_price': 'object',
+            'minimum_nights': 'float64',
+            'maximum_nights': 'float64',
+        },
+    }
+    # columns identifying a unique record across snapshots
+    FILE_KEYS = {
+        'listings': ['listing_id', 'last_scraped'],
+        'reviews': ['id'],
+        'calendars': ['listing_id', 'date'],
+    }
 
-    def __init__(self, city='new-york', start_date='2019-01-01'):
+    def __init__(self, city='new-york', start_date='2019-01-01', base_url=None, max_workers=1, max_retries=3,
+                 backoff_factor=0.5, chunksize=None, cache_dir=None, sink=None, timeout=(10, 60)):
         self.start_date = start_date
         self.city = city
+        self.base_url = base_url or self.BASE_URL
+        # max_workers is the number of concurrent downloads per file family (listings, reviews, calendars)
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        # (connect, read) timeout in seconds of every request, so a stalled connection is retried instead of hanging
+        self.timeout = timeout
+        # when chunksize is set, files are streamed and flushed to the sink chunksize rows at a time
+        self.chunksize = chunksize
+        self.session = self._create_session(pool_size=max_workers * self.FILE_FAMILIES)
+        self.sink = sink or MongoDBSink(db_name='airbnb', upsert_keys=self.FILE_KEYS)
+        # with a cache_dir, downloads are cached on disk and files already loaded into the sink are skipped
+        if cache_dir:
+            self.cache = SnapshotCache(cache_dir)
+            self.manifest = SnapshotManifest(os.path.join(cache_dir, 'manifest.json'))
+        else:
+            self.cache = None
+            self.manifest = None
         self.listing_links = None
         self.calendar_links = None
         self.review_links = None
@@ -33,35 +105,124 @@ class AirBnBScraper(object):
     def execute(self):
         logging.info('Executing Scraper Pipeline...')
         self._get_file_links()
-        listings_list = self._get_listings_data()
-        review_dict = self._get_review_data()
-        calendar_dict = self._get_calendar_data()
+        if self.chunksize or not self.sink.nested:
+            self._stream_data_to_sink()
+            return
 
-        result_list = []
+        if self.max_workers > 1:
+            # download the three file families in parallel, each with its own pool of workers
+            with ThreadPoolExecutor(max_workers=self.FILE_FAMILIES) as executor:
+                listings_future = executor.submit(self._get_listings_data)
+                review_future = executor.submit(self._get_review_data)
+                calendar_future = executor.submit(self._get_calendar_data)
+                df_listings = listings_future.result()
+                review_lists = review_future.result()
+                calendar_lists = calendar_future.result()
+        else:
+            df_listings = self._get_listings_data()
+            review_lists = self._get_review_data()
+            calendar_lists = self._get_calendar_data()
 
         logging.info('Combining Results...')
-        for listing in listings_list:
-            _id = listing['listing_id']
-            temp_dict = listing.copy()
-            if _id in review_dict.keys():
-                temp_dict['review_list'] = review_dict[_id]
-            if _id in calendar_dict.keys():
-                temp_dict['calendar_list'] = calendar_dict[_id]
-            result_list.append(temp_dict)
+        result_list = self._combine_data(df_listings, review_lists, calendar_lists)
+
+        self._push_data_to_sink(result_list)
 
-        self._push_data_to_mongodb(result_list)
+        if self.manifest:
+            for link in self.listing_links + self.review_links + self.calendar_links:
+                self.manifest.mark_ingested(link, metadata=self.cache.get_metadata(link))
 
     @staticmethod
     @timefunc
-    def _push_data_to_mongodb(data):
-        logging.info('Pushing Data to MongoDB...')
-        mongo_handler = MongoDBHandler(db_name='airbnb')
-        mongo_handler.insert_values(collection_name='listings', data=data)
+    def _combine_data(df_listings, review_lists, calendar_lists):
+        if df_listings.empty:
+            return []
+        result_list = AirBnBScraper._to_records(df_listings)
+        # listings without reviews or calendars keep no list field at all, as before, so the lists are only
+        # attached to the documents that have one
+        for field, lists in (('review_list', review_lists), ('calendar_list', calendar_lists)):
+            # a single hash join per family against the listings keyed on listing_id
+            mapped_lists = df_listings['listing_id'].map(lists)
+            mapped_values = mapped_lists.values
+            for position in np.flatnonzero(mapped_lists.notnull().values):
+                result_list[position][field] = mapped_values[position]
+        return result_list
+
+    @timefunc
+    def _push_data_to_sink(self, data):
+        logging.info('Pushing Data to Sink...')
+        self.sink.write_documents(data)
         logging.info('Push Complete')
 
+    @timefunc
+    def _stream_data_to_sink(self):
+        # streaming mode cannot nest reviews and calendars into listings without holding every row in memory,
+        # so each file family is flushed to the sink on its own, keyed by listing_id
+        logging.info('Streaming Data to Sink...')
+        file_list = (
+            [('listings', link) for link in self.listing_links]
+            + [('reviews', link) for link in self.review_links]
+            + [('calendars', link) for link in self.calendar_links]
+        )
+
+        def stream_to_sink(file_family, link):
+            snapshot_date = self._get_snapshot_date(link)
+            num_rows = 0
+            dtype = self.FILE_DTYPES[file_family]
+            sink_dtype = dtype
+            if file_family == 'listings':
+                sink_dtype = {'listing_id' if column == 'id' else column: value for column, value in dtype.items()}
+            for part_number, chunk in enumerate(self._stream_zipfile_to_dataframes(link, dtype=dtype)):
+                if file_family == 'listings':
+                    chunk.rename(columns={'id': 'listing_id'}, inplace=True)
+                self.sink.write(
+                    file_family, chunk, city=self.city, snapshot_date=snapshot_date, dtype=sink_dtype, source=link,
+                    part_number=part_number
+                )
+                num_rows += len(chunk)
+            return num_rows
+
+        def stream_file(file):
+            file_family, link = file
+            # without a cache the body is read while chunks are flushed, so a broken download restarts the whole
+            # file. parts are overwritten from the first chunk and keyed families are upserted, so the rows
+            # already written are not duplicated
+            for attempt in range(self.max_retries + 1):
+                try:
+                    num_rows = stream_to_sink(file_family, link)
+                    break
+                except self.RETRY_EXCEPTIONS as error:
+                    if self.cache or attempt == self.max_retries:
+                        raise
+                    self._wait_before_retry(link, error, attempt)
+            if self.manifest:
+                self.manifest.mark_ingested(link, metadata=self.cache.get_metadata(link), num_rows=num_rows)
+            return num_rows
+
+        if self.max_workers > 1:
+            with ThreadPoolExecutor(max_workers=self.max_workers * self.FILE_FAMILIES) as executor:
+                row_counts = list(tqdm(executor.map(stream_file, file_list), total=len(file_list)))
+        else:
+            row_counts = [stream_file(file) for file in tqdm(file_list)]
+        logging.info(f'Stream Complete: {sum(row_counts)} rows from {len(file_list)} files')
+
+    @staticmethod
+    def _create_session(pool_size):
+        # one keep-alive session shared by all download workers
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    @staticmethod
+    def _get_snapshot_date(link):
+        # links look like http://data.insideairbnb.com/<country>/<state>/<city>/<snapshot_date>/data/<file>
+        return link.split('/')[-3]
+
     def _get_file_links(self):
         logging.info(f'Collecting Links for {self.city.upper()}...')
-        response = urlopen(self.BASE_URL)
+        response = self._request_with_retry(self.base_url).content
         # soup = BeautifulSoup(response, from_encoding=response.info().get_param('charset'))
         soup = BeautifulSoup(response, 'html.parser')
 
@@ -73,12 +234,16 @@ class AirBnBScraper(object):
                 link.endswith('.csv.gz')
                 and (self.city in link)
                 and (
-                    datetime.strptime(link.split('/')[-3], '%Y-%m-%d')
+                    datetime.strptime(self._get_snapshot_date(link), '%Y-%m-%d')
                     > datetime.strptime(self.start_date, '%Y-%m-%d')
                 ),
                 link_list
             )
         )
+        if self.manifest:
+            num_links = len(filtered_link_list)
+            filtered_link_list = [link for link in filtered_link_list if not self.manifest.is_ingested(link)]
+            logging.info(f'{num_links - len(filtered_link_list)} file links already ingested')
         self.listing_links = [link for link in filtered_link_list if 'listings' in link]
         self.calendar_links = [link for link in filtered_link_list if 'calendar' in link]
         self.review_links = [link for link in filtered_link_list if 'review' in link]
@@ -87,64 +252,148 @@ class AirBnBScraper(object):
     @timefunc
     def _get_listings_data(self):
         logging.info('Getting Listings Data...')
-        df_listings = pd.DataFrame()
+        collector = SnapshotCollector(key=self.FILE_KEYS['listings'])
 
         if self.listing_links:
             logging.info('pulling listings data')
-            for link in tqdm(self.listing_links):
-                df_listings = df_listings.append(
-                    self._download_zipfile_to_dataframe(link=link)
-                )
+            for df in self._download_links(self.listing_links, dtype=self.FILE_DTYPES['listings']):
+                df.rename(columns={'id': 'listing_id'}, inplace=True)
+                collector.add(df)
 
         else:
             logging.info('no links to pull')
-        df_listings.rename(columns={'id': 'listing_id'}, inplace=True)
-        return df_listings.drop_duplicates().to_dict(orient='records')
+        return collector.collect()
 
     @timefunc
     def _get_review_data(self):
         logging.info('Getting Review Data...')
-        df_reviews = pd.DataFrame()
+        collector = SnapshotCollector(key=self.FILE_KEYS['reviews'])
 
-        if self.listing_links:
+        if self.review_links:
             logging.info('pulling review data')
-            for link in tqdm(self.review_links):
-                df_reviews = df_reviews.append(
-                    self._download_zipfile_to_dataframe(link=link)
-                )
+            for df in self._download_links(self.review_links, dtype=self.FILE_DTYPES['reviews']):
+                collector.add(df)
 
         else:
             logging.info('no links to pull')
-        return self._prepare_data(df_reviews)
+        return self._prepare_data(collector.collect())
 
     @timefunc
     def _get_calendar_data(self):
         logging.info('Getting Calendar Data...')
-        df_calendars = pd.DataFrame()
+        collector = SnapshotCollector(key=self.FILE_KEYS['calendars'])
 
-        if self.listing_links:
+        if self.calendar_links:
             logging.info('pulling calendar data')
-            for link in tqdm(self.calendar_links):
-                df_calendars = df_calendars.append(
-                    self._download_zipfile_to_dataframe(link=link)
-                )
+            for df in self._download_links(self.calendar_links, dtype=self.FILE_DTYPES['calendars']):
+                collector.add(df)
 
         else:
             logging.info('no links to pull')
-        return self._prepare_data(df_calendars)
+        return self._prepare_data(collector.collect())
 
-    @staticmethod
-    def _download_zipfile_to_dataframe(link):
-        response = requests.get(link)
+    def _download_links(self, links, dtype=None):
+        download = partial(self._download_zipfile_to_dataframe, dtype=dtype)
+        if self.max_workers > 1:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                # map preserves link order so results stay deterministic
+                return list(tqdm(executor.map(download, links), total=len(links)))
+        return [download(link) for link in tqdm(links)]
+
+    def _request_with_retry(self, link, consume=None, **kwargs):
+        # with consume, the response body is read by consume(response) within the same attempt, so errors while
+        # reading a streamed body are retried like errors of the request itself
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = self.session.get(link, timeout=self.timeout, **kwargs)
+                if response.status_code not in self.RETRY_STATUS_CODES or attempt == self.max_retries:
+                    response.raise_for_status()
+                    if consume is None:
+                        return response
+                    with response:
+                        return consume(response)
+                reason = f'status code {response.status_code}'
+                response.close()
+            except self.RETRY_EXCEPTIONS as error:
+                if attempt == self.max_retries:
+                    raise
+                reason = error
+            self._wait_before_retry(link, reason, attempt)
+
+    def _wait_before_retry(self, link, reason, attempt):
+        wait = self.backoff_factor * (2 ** attempt)
+        logging.info(f'error downloading {link}: {reason}, retrying in {wait} seconds')
+        time.sleep(wait)
+
+    def _download_to_cache(self, link):
+        if self.cache.get_metadata(link) and not self.cache.get_validators(link):
+            # snapshot urls are dated, so a cached file without validators is reused as is
+            return self.cache.file_path(link)
+
+        def store(response):
+            if response.status_code == 304:
+                logging.info(f'using cached copy of {link}')
+                return self.cache.file_path(link)
+            return self.cache.store(link, response)
+
+        return self._request_with_retry(
+            link, consume=store, stream=True, headers=self.cache.get_validators(link)
+        )
+
+    def _download_zipfile_to_dataframe(self, link, dtype=None):
+        if self.cache:
+            return pd.read_csv(self._download_to_cache(link), dtype=dtype, compression='gzip')
+        response = self._request_with_retry(link)
         gzip_file = gzip.GzipFile(fileobj=BytesIO(response.content))
-        df = pd.read_csv(gzip_file)
+        df = pd.read_csv(gzip_file, dtype=dtype)
         return df
 
+    def _stream_zipfile_to_dataframes(self, link, dtype=None):
+        if not self.chunksize:
+            # sinks that only take flat data still get whole files when no chunksize is set
+            yield self._download_zipfile_to_dataframe(link, dtype=dtype)
+            return
+        if self.cache:
+            for chunk in pd.read_csv(
+                    self._download_to_cache(link), dtype=dtype, compression='gzip', chunksize=self.chunksize
+            ):
+                yield chunk
+            return
+        response = self._request_with_retry(link, stream=True)
+        with response:
+            # decompress the body as it arrives instead of buffering response.content
+            response.raw.decode_content = True
+            gzip_file = gzip.GzipFile(fileobj=response.raw)
+            for chunk in pd.read_csv(gzip_file, dtype=dtype, chunksize=self.chunksize):
+                yield chunk
+
+    @staticmethod
+    def _to_records(df):
+        # one dict per row built from column lists, which avoids the per-cell overhead of
+        # DataFrame.to_dict(orient='records'). python objects are only created here, where documents are built.
+        # rows go through a generated function returning a dict display, about twice as fast as dict(zip(...));
+        # its source only holds positional names, the column names are passed in through its globals
+        columns = df.columns.tolist()
+        arguments = [f'value_{position}' for position in range(len(columns))]
+        keys = [f'key_{position}' for position in range(len(columns))]
+        items = ', '.join(f'{key}: {argument}' for key, argument in zip(keys, arguments))
+        make_record = eval(f"lambda {', '.join(arguments)}: {{{items}}}", dict(zip(keys, columns)))
+        return list(map(make_record, *[df[column].tolist() for column in columns]))
+
     @staticmethod
     def _prepare_data(df):
-        _list = df.drop_duplicates().to_dict(orient='records')
-        _list = sorted(_list, key=itemgetter('listing_id'))
-        _list_grouped = {
-            k: list(v) for k, v in itertools.groupby(_list, key=itemgetter('listing_id'))
-        }
-        return _list_grouped
+        # group rows by listing_id with one stable sort and the group boundaries of the sorted keys,
+        # returning a series of record lists indexed by listing_id
+        if df.empty:
+            return pd.Series(dtype=object)
+        df = df.sort_values('listing_id', kind='mergesort')
+        listing_ids = df['listing_id'].values
+        boundaries = np.flatnonzero(listing_ids[1:] != listing_ids[:-1]) + 1
+        starts = np.concatenate(([0], boundaries))
+        ends = np.concatenate((boundaries, [len(listing_ids)]))
+        records = AirBnBScraper._to_records(df)
+        return pd.Series(
+            [records[start:end] for start, end in zip(starts, ends)],
+            index=listing_ids[starts],
+            dtype=object
+        )
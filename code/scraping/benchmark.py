@@ -0,0 +1,140 @@
+import gzip
+import itertools
+import time
+from io import BytesIO
+from operator import itemgetter
+
+import numpy as np
+import pandas as pd
+
+from scraping.airbnb_scraper import AirBnBScraper
+from scraping.collector import SnapshotCollector
+
+
+def make_calendar_snapshots(num_snapshots, num_listings=2000, num_days=30, random_state=0):
+    # consecutive snapshots overlap on most (listing_id, date) pairs, like the real calendar files
+    rng = np.random.RandomState(random_state)
+    snapshots = []
+    for snapshot in range(num_snapshots):
+        dates = pd.date_range('2019-01-01', periods=num_days) + pd.Timedelta(days=snapshot * 7)
+        df = pd.DataFrame({
+            'listing_id': np.repeat(np.arange(num_listings), num_days),
+            'date': np.tile(dates.strftime('%Y-%m-%d'), num_listings),
+            'available': rng.choice(['t', 'f'], size=num_listings * num_days),
+            'price': ['$' + str(price) + '.00' for price in rng.randint(50, 500, size=num_listings * num_days)],
+            'minimum_nights': rng.randint(1, 30, size=num_listings * num_days).astype(float),
+        })
+        buffer = BytesIO()
+        with gzip.GzipFile(fileobj=buffer, mode='wb') as gzip_file:
+            gzip_file.write(df.to_csv(index=False).encode('utf-8'))
+        snapshots.append(buffer.getvalue())
+    return snapshots
+
+
+def append_accumulation(snapshots):
+    df_calendars = pd.DataFrame()
+    for snapshot in snapshots:
+        df_calendars = df_calendars.append(pd.read_csv(gzip.GzipFile(fileobj=BytesIO(snapshot))))
+    return df_calendars.drop_duplicates()
+
+
+def collector_accumulation(snapshots):
+    collector = SnapshotCollector(key=AirBnBScraper.FILE_KEYS['calendars'])
+    for snapshot in snapshots:
+        collector.add(
+            pd.read_csv(gzip.GzipFile(fileobj=BytesIO(snapshot)), dtype=AirBnBScraper.FILE_DTYPES['calendars'])
+        )
+    return collector.collect()
+
+
+def run_benchmark(snapshot_counts=(1, 2, 4, 8, 16, 32), num_listings=2000, num_days=30):
+    methods = {'collector': collector_accumulation}
+    if hasattr(pd.DataFrame, 'append'):
+        # DataFrame.append was removed in pandas 2
+        methods['append'] = append_accumulation
+
+    results = []
+    for num_snapshots in snapshot_counts:
+        snapshots = make_calendar_snapshots(num_snapshots, num_listings=num_listings, num_days=num_days)
+        for method_name, method in methods.items():
+            start = time.perf_counter()
+            df = method(snapshots)
+            elapsed = time.perf_counter() - start
+            results.append({
+                'method': method_name,
+                'num_snapshots': num_snapshots,
+                'num_rows': len(df),
+                'seconds': elapsed,
+                'seconds_per_snapshot': elapsed / num_snapshots
+            })
+    return pd.DataFrame(results).pivot(index='num_snapshots', columns='method', values='seconds_per_snapshot')
+
+
+def make_nesting_data(num_listings=50000, num_reviews=1000000, num_calendar_rows=1000000, random_state=0):
+    # a listings frame and review / calendar rows spread over the listings, with some listings left without any
+    rng = np.random.RandomState(random_state)
+    df_listings = pd.DataFrame({
+        'listing_id': np.arange(num_listings),
+        'name': rng.choice(['loft', 'studio', 'room'], size=num_listings),
+        'last_scraped': '2019-12-01',
+        'price': rng.randint(50, 500, size=num_listings).astype(float),
+    })
+    df_reviews = pd.DataFrame({
+        'listing_id': rng.randint(0, int(num_listings * 0.9), size=num_reviews),
+        'id': np.arange(num_reviews),
+        'date': '2019-11-01',
+        'reviewer_id': rng.randint(0, 10 ** 8, size=num_reviews),
+        'reviewer_name': rng.choice(['Ann', 'Bob', 'Cy'], size=num_reviews),
+        'comments': rng.choice(['great', 'ok', None], size=num_reviews),
+    })
+    df_calendars = pd.DataFrame({
+        'listing_id': rng.randint(0, int(num_listings * 0.9), size=num_calendar_rows),
+        'date': '2019-12-02',
+        'available': rng.choice(['t', 'f'], size=num_calendar_rows),
+        'price': '$100.00',
+        'minimum_nights': rng.randint(1, 30, size=num_calendar_rows).astype(float),
+    })
+    return df_listings, df_reviews, df_calendars
+
+
+def legacy_nesting(df_listings, df_reviews, df_calendars):
+    # the dict-per-row grouping and per-listing copy the scraper used before the columnar nesting
+    def prepare_data(df):
+        _list = sorted(df.to_dict(orient='records'), key=itemgetter('listing_id'))
+        return {k: list(v) for k, v in itertools.groupby(_list, key=itemgetter('listing_id'))}
+
+    review_dict = prepare_data(df_reviews)
+    calendar_dict = prepare_data(df_calendars)
+    result_list = []
+    for listing in df_listings.to_dict(orient='records'):
+        _id = listing['listing_id']
+        temp_dict = listing.copy()
+        if _id in review_dict.keys():
+            temp_dict['review_list'] = review_dict[_id]
+        if _id in calendar_dict.keys():
+            temp_dict['calendar_list'] = calendar_dict[_id]
+        result_list.append(temp_dict)
+    return result_list
+
+
+def columnar_nesting(df_listings, df_reviews, df_calendars):
+    return AirBnBScraper._combine_data(
+        df_listings, AirBnBScraper._prepare_data(df_reviews), AirBnBScraper._prepare_data(df_calendars)
+    )
+
+
+def run_nesting_benchmark(num_listings=50000, num_reviews=1000000, num_calendar_rows=1000000):
+    data = make_nesting_data(num_listings, num_reviews, num_calendar_rows)
+    results = {}
+    for method_name, method in {'legacy': legacy_nesting, 'columnar': columnar_nesting}.items():
+        start = time.perf_counter()
+        method(*data)
+        results[method_name] = time.perf_counter() - start
+    results['speedup'] = results['legacy'] / results['columnar']
+    return pd.Series(results)
+
+
+if __name__ == '__main__':
+    # seconds per snapshot stays flat for the collector and grows linearly with append
+    print(run_benchmark())
+    print(run_nesting_benchmark())
@@ -0,0 +1,25 @@
+import pandas as pd
+
+
+class SnapshotCollector(object):
+    # gathers per-file frames and concatenates them once instead of growing a frame with append
+
+    def __init__(self, key=None):
+        self.key = key
+        self.frames = []
+
+    def add(self, df):
+        if not df.empty:
+            self.frames.append(df)
+
+    def collect(self):
+        if not self.frames:
+            return pd.DataFrame()
+        df = pd.concat(self.frames, ignore_index=True, sort=False, copy=False)
+        self.frames = []
+        if self.key:
+            # deduplicate on the key columns instead of hashing every column of every row
+            subset = [column for column in self.key if column in df.columns]
+            if subset:
+                return df.drop_duplicates(subset=subset).reset_index(drop=True)
+        return df.drop_duplicates().reset_index(drop=True)
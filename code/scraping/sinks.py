@@ -0,0 +1,133 @@
+import glob
+import hashlib
+import logging
+import os
+import threading
+import uuid
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from utils.database_utils.mongodb_handler import MongoDBHandler
+
+logging.basicConfig(level=logging.INFO)
+
+
+class MongoDBSink(object):
+    # accepts both nested listing documents and flat per-file chunks
+    nested = True
+
+    def __init__(self, db_name='airbnb', upsert_keys=None, batch_size=1000, max_workers=1):
+        self.db_name = db_name
+        # file family -> key columns; families with a key are upserted so reruns do not duplicate records
+        self.upsert_keys = upsert_keys or {}
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+
+    def write_documents(self, documents, collection_name='listings'):
+        return self._write(collection_name, documents, upsert_key=self.upsert_keys.get('listings'))
+
+    def write(self, file_family, df, city, snapshot_date, dtype=None, source=None, part_number=None):
+        # flat chunks go to their own <file_family>_flat collections, so upserts of flat listing rows never replace
+        # the nested listing documents of the buffered mode
+        return self._write(f'{file_family}_flat', df, upsert_key=self.upsert_keys.get(file_family))
+
+    def _write(self, collection_name, data, upsert_key):
+        mongo_handler = MongoDBHandler(db_name=self.db_name)
+        result = mongo_handler.bulk_write(
+            collection_name,
+            data,
+            batch_size=self.batch_size,
+            max_workers=self.max_workers,
+            upsert_key=upsert_key
+        )
+        logging.info(
+            f'{collection_name}: {result.inserted_count} inserted, {result.updated_count} updated, '
+            f'{result.failed_count} failed'
+        )
+        return result
+
+
+class ParquetSink(object):
+    # writes flat per-file chunks as parquet files partitioned by file family, city and snapshot date:
+    # <root_dir>/<file_family>/city=<city>/snapshot_date=<snapshot_date>/part-<id>.parquet
+    # parts of a source file are named by a hash of its link and the chunk number, so streaming the file again
+    # overwrites its parts instead of adding rows twice
+    nested = False
+
+    def __init__(self, root_dir, row_group_size=100000, compression='snappy'):
+        self.root_dir = root_dir
+        self.row_group_size = row_group_size
+        self.compression = compression
+        self._lock = threading.Lock()
+
+    def write(self, file_family, df, city, snapshot_date, dtype=None, source=None, part_number=None):
+        table = self._to_table(df, dtype or {})
+
+        directory = os.path.join(
+            self.root_dir, file_family, f'city={city}', f'snapshot_date={snapshot_date}'
+        )
+        with self._lock:
+            os.makedirs(directory, exist_ok=True)
+        if source is None:
+            path = os.path.join(directory, f'part-{uuid.uuid4().hex}.parquet')
+        else:
+            source_key = hashlib.sha1(source.encode('utf-8')).hexdigest()[:16]
+            if not part_number:
+                # parts left behind by an interrupted run of the same file
+                for stale_path in glob.glob(os.path.join(directory, f'part-{source_key}-*.parquet')):
+                    os.remove(stale_path)
+            path = os.path.join(directory, f'part-{source_key}-{part_number or 0:05d}.parquet')
+        # hidden while being written, so readers of the dataset never see a partial file
+        temp_path = os.path.join(directory, f'.{os.path.basename(path)}.tmp')
+        pq.write_table(
+            table,
+            temp_path,
+            row_group_size=self.row_group_size,
+            compression=self.compression,
+            use_dictionary=True,
+            write_statistics=True
+        )
+        os.replace(temp_path, path)
+        return path
+
+    @staticmethod
+    def _to_table(df, dtype):
+        # declared columns keep their dtype and every other column is stored as text, so the same column gets the
+        # same type in every file even when pandas infers float64 for an all-empty column in one of them
+        df = df.copy(deep=False)
+        fields = []
+        for column in df.columns:
+            if column in dtype and np.dtype(dtype[column]) != np.dtype('object'):
+                fields.append(pa.field(column, pa.from_numpy_dtype(np.dtype(dtype[column]))))
+                continue
+            series = df[column]
+            if not pd.api.types.is_object_dtype(series):
+                df[column] = ParquetSink._format_text(series)
+            fields.append(pa.field(column, pa.string()))
+        return pa.Table.from_pandas(df, schema=pa.schema(fields), preserve_index=False)
+
+    @staticmethod
+    def _format_text(series):
+        # every value is formatted on its own, so the text of a value never depends on the other values of its chunk.
+        # integral floats are written without a fraction, as pandas reads integer columns with missing values as float
+        text = series.astype(str)
+        if pd.api.types.is_float_dtype(series):
+            values = series.to_numpy(dtype='float64', na_value=np.nan)
+            with np.errstate(invalid='ignore'):
+                integral = (values % 1 == 0) & (np.abs(values) < 2 ** 63)
+            text[integral] = values[integral].astype('int64').astype(str)
+        return text.where(series.notnull(), None)
+
+    def read(self, file_family, columns=None, filters=None):
+        # filters follow pyarrow's DNF format, e.g. [('snapshot_date', '>=', '2020-01-01')], and prune whole
+        # partitions and row groups before anything is read
+        table = pq.read_table(
+            os.path.join(self.root_dir, file_family),
+            columns=columns,
+            filters=filters,
+            memory_map=True
+        )
+        return table.to_pandas()
@@ -0,0 +1,96 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from datetime import datetime
+
+logging.basicConfig(level=logging.INFO)
+
+
+def _write_json_atomic(path, data):
+    # write to a temporary file and rename so an interrupted run never leaves a truncated file behind
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w') as json_file:
+        json.dump(data, json_file, indent=2, sort_keys=True)
+    os.replace(temp_path, path)
+
+
+class SnapshotCache(object):
+    # on-disk cache of downloaded snapshot files keyed by url and validated with ETag / Last-Modified
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def _key(link):
+        return hashlib.sha1(link.encode('utf-8')).hexdigest()
+
+    def file_path(self, link):
+        return os.path.join(self.cache_dir, self._key(link) + '.csv.gz')
+
+    def _metadata_path(self, link):
+        return os.path.join(self.cache_dir, self._key(link) + '.json')
+
+    def get_metadata(self, link):
+        if not os.path.exists(self.file_path(link)) or not os.path.exists(self._metadata_path(link)):
+            return None
+        with open(self._metadata_path(link)) as json_file:
+            return json.load(json_file)
+
+    def get_validators(self, link):
+        # headers for a conditional request against the cached copy of link
+        metadata = self.get_metadata(link) or {}
+        headers = {}
+        if metadata.get('etag'):
+            headers['If-None-Match'] = metadata['etag']
+        if metadata.get('last_modified'):
+            headers['If-Modified-Since'] = metadata['last_modified']
+        return headers
+
+    def store(self, link, response, chunk_size=1 << 20):
+        path = self.file_path(link)
+        temp_path = path + '.part'
+        with open(temp_path, 'wb') as cache_file:
+            for block in response.iter_content(chunk_size=chunk_size):
+                cache_file.write(block)
+        os.replace(temp_path, path)
+        _write_json_atomic(
+            self._metadata_path(link),
+            {
+                'link': link,
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+                'downloaded_at': datetime.utcnow().isoformat()
+            }
+        )
+        return path
+
+
+class SnapshotManifest(object):
+    # record of snapshot files that were completely loaded into the sink
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path) as json_file:
+                self.entries = json.load(json_file)
+        else:
+            self.entries = {}
+
+    def is_ingested(self, link):
+        return link in self.entries
+
+    def mark_ingested(self, link, metadata=None, num_rows=None):
+        metadata = metadata or {}
+        with self._lock:
+            self.entries[link] = {
+                'etag': metadata.get('etag'),
+                'last_modified': metadata.get('last_modified'),
+                'num_rows': num_rows,
+                'ingested_at': datetime.utcnow().isoformat()
+            }
+            # persist after every file so an interrupted run resumes from the last completed one
+            _write_json_atomic(self.path, self.entries)
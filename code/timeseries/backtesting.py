@@ -0,0 +1,77 @@
+import copy
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+
+class RollingOriginBacktester:
+    # rolling-origin evaluation of a forecaster over every origin from initial_window on, forecasting horizons
+    # 1..horizon at each origin. the expanding window advances the fitted forecaster with update() between
+    # origins; the sliding window refits on the last initial_window observations
+
+    def __init__(self, forecaster, horizon=1, initial_window=10, step=1, window='expanding'):
+        if window not in ['expanding', 'sliding']:
+            raise ValueError(f'{window} not in list of admissable windows: [\'expanding\', \'sliding\']')
+        self.forecaster = forecaster
+        self.horizon = horizon
+        self.initial_window = initial_window
+        self.step = step
+        self.window = window
+
+    def run(self, series):
+        series = np.asarray(series, dtype=float)
+        T = len(series)
+        origins = np.arange(self.initial_window, T, self.step)
+        steps = np.arange(1, self.horizon + 1)
+        forecasts = np.empty((len(origins), self.horizon))
+
+        forecaster = copy.deepcopy(self.forecaster)
+        if self.window == 'expanding':
+            forecaster.fit(series[:self.initial_window])
+        for row, origin in enumerate(origins):
+            if self.window == 'sliding':
+                forecaster.fit(series[origin - self.initial_window:origin])
+            forecasts[row] = [forecaster.predict(n) for n in steps]
+            if self.window == 'expanding':
+                forecaster.update(series[origin:origin + self.step])
+
+        # actuals for every (origin, horizon) pair, NaN past the end of the series
+        actual_index = origins[:, None] + steps[None, :] - 1
+        actuals = np.append(series, np.nan)[np.minimum(actual_index, T)]
+        return {
+            'origins': origins,
+            'forecasts': forecasts,
+            'actuals': actuals,
+            'metrics': self.compute_metrics(forecasts, actuals)
+        }
+
+    def run_panel(self, series_list, n_jobs=None):
+        # backtest many series, spread across processes when n_jobs is set
+        if n_jobs and n_jobs > 1:
+            with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+                results = list(executor.map(self.run, series_list))
+        else:
+            results = [self.run(series) for series in series_list]
+        metrics = pd.concat(
+            [result['metrics'] for result in results],
+            keys=range(len(results)),
+            names=['series', 'horizon']
+        )
+        return results, metrics
+
+    @staticmethod
+    def compute_metrics(forecasts, actuals):
+        # error metrics per horizon over all origins, ignoring origins whose actuals are not observed yet
+        errors = actuals - forecasts
+        with np.errstate(invalid='ignore', divide='ignore'):
+            metrics = pd.DataFrame(
+                {
+                    'mae': np.nanmean(np.abs(errors), axis=0),
+                    'rmse': np.sqrt(np.nanmean(errors ** 2, axis=0)),
+                    'mape': np.nanmean(np.abs(errors / actuals), axis=0) * 100,
+                    'num_origins': np.sum(~np.isnan(errors), axis=0)
+                },
+                index=pd.RangeIndex(1, forecasts.shape[1] + 1, name='horizon')
+            )
+        return metrics
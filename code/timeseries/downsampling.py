@@ -0,0 +1,47 @@
+import numpy as np
+
+
+def lttb_indices(x, y, num_points):
+    # largest-triangle-three-buckets: keeps the first and last point and, from each of num_points - 2 buckets,
+    # the point forming the largest triangle with the previously kept point and the mean of the next bucket
+    n = len(y)
+    if num_points >= n or num_points < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    edges = np.linspace(1, n - 1, num_points - 1).astype(np.int64)
+    selected = np.empty(num_points, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+
+    previous = 0
+    for bucket in range(num_points - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        next_end = edges[bucket + 2] if bucket + 2 < len(edges) else n
+        next_x = x[end:next_end].mean()
+        next_y = y[end:next_end].mean()
+        area = np.abs(
+            (x[previous] - next_x) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end]) * (next_y - y[previous])
+        )
+        previous = start + np.argmax(area)
+        selected[bucket + 1] = previous
+    return selected
+
+
+def minmax_indices(y, num_buckets):
+    # indices of the minimum and maximum of each of num_buckets equal buckets, plus both end points
+    n = len(y)
+    if 2 * num_buckets >= n or num_buckets < 1:
+        return np.arange(n)
+    bucket_size = int(np.ceil(n / num_buckets))
+    padded = np.full(bucket_size * int(np.ceil(n / bucket_size)), np.nan)
+    padded[:n] = y
+    buckets = padded.reshape(-1, bucket_size)
+    offsets = np.arange(len(buckets)) * bucket_size
+    # NaN never wins; all-NaN buckets fall back to their first position
+    indices = np.concatenate((
+        offsets + np.argmin(np.where(np.isnan(buckets), np.inf, buckets), axis=1),
+        offsets + np.argmax(np.where(np.isnan(buckets), -np.inf, buckets), axis=1),
+        [0, n - 1]
+    ))
+    return np.unique(np.minimum(indices, n - 1))
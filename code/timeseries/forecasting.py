@@ -1,4 +1,7 @@
+from collections import deque
+
 import numpy as np
+import pandas as pd
 
 
 class BaseForecaster:
@@ -8,6 +11,15 @@ class BaseForecaster:
     def predict(self, *args, **kwargs):
         return NotImplemented
 
+    def update(self, new_obs):
+        # advance the fitted state with one or more new observations, O(1) per observation
+        for y in np.atleast_1d(new_obs):
+            self._update(y)
+        return self
+
+    def _update(self, y):
+        return NotImplemented
+
 
 class NaiveForecaster(BaseForecaster):
     def __init__(self):
@@ -20,58 +32,214 @@ class NaiveForecaster(BaseForecaster):
     def predict(self, n):
         return self.y_hat
 
+    def _update(self, y):
+        self.y_hat = y
+
 
 class NaiveSeasonalForecaster(BaseForecaster):
     def __init__(self, period=1):
         self.period = period
-        self.series = None
+        self.last_season = None
         self.T = None
 
     def fit(self, series):
         self.T = len(series)
-        self.series = series
+        # only the last season is needed to forecast any horizon
+        self.last_season = deque(series[-self.period:], maxlen=self.period)
         return self
 
     def predict(self, n=1):
-        k = int((n - 1) / self.period)
-        last_seasonal_index = (self.T + n) - self.period * (k + 1)
-        y_hat = self.series[last_seasonal_index - 1]
+        y_hat = self.last_season[(n - 1) % self.period]
         return y_hat
 
+    def _update(self, y):
+        self.T += 1
+        self.last_season.append(y)
+
 
 class DriftForecaster(BaseForecaster):
     def __init__(self, window_size=0):
         self.window_size = window_size
-        self.series = None
+        self.window = None
+        self.y_0 = None
         self.T = None
 
     def fit(self, series):
         self.T = len(series)
-        self.series = series
+        self.y_0 = series[0]
+        # last window_size + 1 observations, so window[0] is the start of the drift window
+        self.window = deque(series[-(self.window_size + 1):], maxlen=self.window_size + 1)
         return self
 
     def predict(self, n):
-        window_index = self.T - (self.window_size + 1)
-        y_t = self.series[-1]
-        y_w = self.series[window_index]
+        y_t = self.window[-1]
+        y_w = self.window[0]
         if self.window_size > 0:
             drift = n * ((y_t - y_w) / self.window_size)
         else:
-            drift = n * ((y_t - self.series[0]) / (self.T - 1))
+            drift = n * ((y_t - self.y_0) / (self.T - 1))
         return y_t + drift
 
+    def _update(self, y):
+        self.T += 1
+        self.window.append(y)
+
 
 class SimpleAverageForecaster(BaseForecaster):
     def __init__(self, window_size=0):
         self.window_size = window_size
         self.y_bar = None
+        self.window = None
+        self.total = None
+        self.count = None
 
     def fit(self, series):
         if self.window_size < 1:
             self.y_bar = np.mean(series)
+            self.total = np.sum(series)
+            self.count = len(series)
         else:
             self.y_bar = np.mean(series[-self.window_size:])
+            self.window = deque(series[-self.window_size:], maxlen=self.window_size)
+            self.total = np.sum(self.window)
+            self.count = len(self.window)
         return self
 
     def predict(self, n):
         return self.y_bar
+
+    def _update(self, y):
+        if self.window_size < 1:
+            self.count += 1
+        else:
+            if len(self.window) == self.window_size:
+                self.total -= self.window[0]
+            self.window.append(y)
+            self.count = len(self.window)
+        self.total += y
+        self.y_bar = self.total / self.count
+
+
+def long_to_panel(dataframe, series_column, time_column, value_column):
+    # pivot long-format data into a 2-D array with one left-aligned row per series, padded with NaN
+    dataframe = dataframe.sort_values([series_column, time_column])
+    codes, series_ids = pd.factorize(dataframe[series_column], sort=True)
+    positions = dataframe.groupby(series_column, sort=True).cumcount().values
+    panel = np.full((len(series_ids), positions.max() + 1 if len(positions) else 0), np.nan)
+    panel[codes, positions] = dataframe[value_column].values
+    return series_ids, panel
+
+
+class BasePanelForecaster(BaseForecaster):
+    # fits every series of a panel (2-D array with one series per row, NaN marking missing or padded values,
+    # or a long-format dataframe) at once and predicts the full 1..h horizon matrix
+
+    def __init__(self):
+        self.series_ids = None
+        self.last_index = None
+        self.lengths = None
+
+    def fit(self, panel, series_column='series_id', time_column='time', value_column='value'):
+        if isinstance(panel, pd.DataFrame):
+            self.series_ids, panel = long_to_panel(panel, series_column, time_column, value_column)
+        else:
+            self.series_ids = None
+        panel = np.atleast_2d(np.asarray(panel, dtype=float))
+        valid = ~np.isnan(panel)
+        self.lengths = valid.sum(axis=1)
+        # position of the last observed value of every series
+        self.last_index = panel.shape[1] - 1 - np.argmax(valid[:, ::-1], axis=1)
+        self._fit(panel, valid)
+        return self
+
+    def update(self, new_obs):
+        # panel forecasters keep no running state per series, so they are refitted on the extended panel
+        raise NotImplementedError(f'{type(self).__name__} does not support update, fit it on the extended panel')
+
+    def predict(self, h=1):
+        steps = np.arange(1, h + 1)
+        forecasts = self._predict(steps)
+        forecasts[self.lengths == 0] = np.nan
+        if self.series_ids is not None:
+            return pd.DataFrame(forecasts, index=self.series_ids, columns=steps)
+        return forecasts
+
+    @staticmethod
+    def _take(panel, index):
+        # panel values at one position per series, NaN where the position falls before the series start
+        values = np.take_along_axis(panel, np.clip(index, 0, None)[:, None], axis=1)[:, 0]
+        values[index < 0] = np.nan
+        return values
+
+    def _fit(self, panel, valid):
+        return NotImplemented
+
+    def _predict(self, steps):
+        return NotImplemented
+
+
+class PanelNaiveForecaster(BasePanelForecaster):
+    def __init__(self):
+        super().__init__()
+        self.y_hat = None
+
+    def _fit(self, panel, valid):
+        self.y_hat = self._take(panel, self.last_index)
+
+    def _predict(self, steps):
+        return np.repeat(self.y_hat[:, None], len(steps), axis=1)
+
+
+class PanelNaiveSeasonalForecaster(BasePanelForecaster):
+    def __init__(self, period=1):
+        super().__init__()
+        self.period = period
+        self.last_season = None
+
+    def _fit(self, panel, valid):
+        # last observed season of every series, oldest value first
+        season_index = self.last_index[:, None] - self.period + 1 + np.arange(self.period)
+        self.last_season = np.take_along_axis(panel, np.clip(season_index, 0, None), axis=1)
+        self.last_season[season_index < 0] = np.nan
+
+    def _predict(self, steps):
+        return self.last_season[:, (steps - 1) % self.period]
+
+
+class PanelDriftForecaster(BasePanelForecaster):
+    def __init__(self, window_size=0):
+        super().__init__()
+        self.window_size = window_size
+        self.y_t = None
+        self.drift = None
+
+    def _fit(self, panel, valid):
+        self.y_t = self._take(panel, self.last_index)
+        if self.window_size > 0:
+            y_w = self._take(panel, self.last_index - self.window_size)
+            self.drift = (self.y_t - y_w) / self.window_size
+        else:
+            first_index = np.argmax(valid, axis=1)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                self.drift = (self.y_t - self._take(panel, first_index)) / (self.last_index - first_index)
+
+    def _predict(self, steps):
+        return self.y_t[:, None] + steps[None, :] * self.drift[:, None]
+
+
+class PanelSimpleAverageForecaster(BasePanelForecaster):
+    def __init__(self, window_size=0):
+        super().__init__()
+        self.window_size = window_size
+        self.y_bar = None
+
+    def _fit(self, panel, valid):
+        in_window = valid
+        if self.window_size > 0:
+            positions = np.arange(panel.shape[1])
+            in_window = valid & (positions[None, :] > (self.last_index - self.window_size)[:, None])
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self.y_bar = np.where(in_window, panel, 0).sum(axis=1) / in_window.sum(axis=1)
+
+    def _predict(self, steps):
+        return np.repeat(self.y_bar[:, None], len(steps), axis=1)
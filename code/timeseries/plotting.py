@@ -1,19 +1,56 @@
+from concurrent.futures import ThreadPoolExecutor
+
 from matplotlib import pyplot as plt
+import numpy as np
 import seaborn as sns
 
 import pandas as pd
 
+from timeseries.downsampling import lttb_indices, minmax_indices
+from timeseries.stats import auto_correlation_fft
+
 
 class TimeSeriesPlotter:
 
-    def __init__(self, series):
+    def __init__(self, series, max_points=None, downsample="lttb"):
+        # long series are downsampled before drawing, to max_points or by default to the pixel width of the axes,
+        # with "lttb" (shape preserving), "minmax" (keeps every extreme) or None to draw every point
+        if downsample not in ["lttb", "minmax", None]:
+            raise ValueError(f"{downsample} not in list of admissable downsampling methods: ['lttb', 'minmax', None]")
         self.series = series
+        self.max_points = max_points
+        self.downsample = downsample
+
+    def _target_points(self):
+        if self.max_points:
+            return self.max_points
+        return int(plt.gca().get_window_extent().width)
+
+    def _downsample(self, series, method=None):
+        method = method or self.downsample
+        num_points = self._target_points()
+        if self.downsample is None or len(series) <= num_points:
+            return series
+        series = series.dropna()
+        if method == "minmax":
+            # one minimum and one maximum per bucket
+            indices = minmax_indices(series.values, num_points // 2)
+        else:
+            if isinstance(series.index, pd.DatetimeIndex):
+                x = series.index.asi8
+            elif pd.api.types.is_numeric_dtype(series.index):
+                x = series.index.values
+            else:
+                x = np.arange(len(series))
+            indices = lttb_indices(x, series.values, num_points)
+        return series.iloc[indices]
 
     def time_plot(self, title="", x_label="", y_label="", style="line"):
+        series = self._downsample(self.series)
         if style == "line":
-            sns.lineplot(data=self.series)
+            sns.lineplot(data=series)
         if style == "dotted":
-            sns.scatterplot(data=self.series)
+            sns.scatterplot(data=series)
         plt.title(title)
         plt.xlabel(x_label)
         plt.ylabel(y_label)
@@ -25,7 +62,8 @@ class TimeSeriesPlotter:
 
         for name, group in groups:
             names.append(name.year)
-            sns.lineplot(data=group.values)
+            # positions within the period on the x axis, as when plotting group.values
+            sns.lineplot(data=self._downsample(pd.Series(group.values)))
 
         plt.legend(labels=names, loc=(1.05, 0))
         plt.title(title)
@@ -37,19 +75,123 @@ class TimeSeriesPlotter:
         pd.plotting.lag_plot(self.series, lag)
         plt.show()
 
-    def acf_plot(self):
-        pd.plotting.autocorrelation_plot(self.series)
+    def acf_plot(self, lags=None):
+        # same figure as pd.plotting.autocorrelation_plot, with the autocorrelations computed by FFT
+        values = self.series.dropna().values
+        n = len(values)
+        acf = pd.Series(auto_correlation_fft(values, nlags=lags)[1:])
+        acf.index = np.arange(1, len(acf) + 1)
+        # min/max whatever the configured method, so no spike of the correlogram is dropped
+        acf = self._downsample(acf, method="minmax")
+
+        ax = plt.gca()
+        ax.set_xlim(1, acf.index[-1])
+        ax.set_ylim(-1.0, 1.0)
+        # 95% and 99% confidence bands
+        for z, linestyle in [(1.959963984540054, "-"), (2.5758293035489004, "--")]:
+            ax.axhline(y=z / np.sqrt(n), linestyle=linestyle, color="grey")
+            ax.axhline(y=-z / np.sqrt(n), linestyle=linestyle, color="grey")
+        ax.axhline(y=0.0, color="black")
+        ax.plot(acf.index, acf.values)
+        ax.set_xlabel("Lag")
+        ax.set_ylabel("Autocorrelation")
+        ax.grid()
         plt.show()
 
 
 class MultivariateTimeSeriesPlotter:
 
-    def __init__(self, dataframe):
+    def __init__(self, dataframe, max_rows=10000, bins=50, n_jobs=None):
+        # above max_rows, pair plots switch from a full scatter to binned 2-D histograms (or a stratified sample)
         self.dataframe = dataframe
+        self.max_rows = max_rows
+        self.bins = bins
+        self.n_jobs = n_jobs
 
-    def pair_plot(self, title="", x_label="", y_label=""):
-        sns.pairplot(self.dataframe, corner=True)
-        plt.title(title)
+    def pair_plot(self, title="", x_label="", y_label="", kind="auto", sample_size=None, random_state=0):
+        # kind is "scatter" (every row), "sample" (stratified time sample of sample_size rows, max_rows by default),
+        # "hist" (2-D histogram per pair) or "auto" (scatter up to max_rows, hist above)
+        if kind not in ["auto", "scatter", "sample", "hist"]:
+            raise ValueError(f"{kind} not in list of admissable kinds: ['auto', 'scatter', 'sample', 'hist']")
+        if kind == "auto":
+            kind = "scatter" if len(self.dataframe) <= self.max_rows else "hist"
+
+        if kind == "hist":
+            self._binned_pair_plot()
+            plt.suptitle(title)
+        else:
+            dataframe = self.dataframe
+            if kind == "sample":
+                dataframe = self.stratified_sample(sample_size or self.max_rows, random_state=random_state)
+            sns.pairplot(dataframe, corner=True)
+            plt.title(title)
         plt.xlabel(x_label)
         plt.ylabel(y_label)
         plt.show()
+
+    def stratified_sample(self, sample_size, num_strata=100, random_state=0):
+        # equal number of random rows from each of num_strata consecutive time blocks, in time order
+        n = len(self.dataframe)
+        if sample_size >= n:
+            return self.dataframe
+        num_strata = min(num_strata, sample_size)
+        rng = np.random.RandomState(random_state)
+        strata = np.arange(n) * num_strata // n
+        # rows sorted by stratum, randomly within each stratum
+        order = np.lexsort((rng.uniform(size=n), strata))
+        counts = np.bincount(strata, minlength=num_strata)
+        rank = np.arange(n) - np.repeat(np.cumsum(counts) - counts, counts)
+        selected = np.sort(order[rank < int(np.ceil(sample_size / num_strata))])
+        return self.dataframe.iloc[selected]
+
+    def binned_pair_counts(self):
+        # bin every numeric column once, then count each column pair with a single bincount. pairs are
+        # counted in a thread pool when n_jobs is set
+        numeric = self.dataframe.select_dtypes(include=[np.number])
+        values = numeric.values.astype(float)
+        minimum = np.nanmin(values, axis=0)
+        maximum = np.nanmax(values, axis=0)
+        span = np.where(maximum > minimum, maximum - minimum, 1.0)
+        edges = minimum[:, None] + span[:, None] * np.linspace(0, 1, self.bins + 1)[None, :]
+        with np.errstate(invalid="ignore"):
+            codes = np.clip(np.floor((values - minimum) / span * self.bins), 0, self.bins - 1)
+        codes = np.where(np.isnan(values), -1, codes).astype(np.int64)
+
+        def count_pair(pair):
+            i, j = pair
+            valid = (codes[:, i] >= 0) & (codes[:, j] >= 0)
+            counts = np.bincount(codes[valid, i] * self.bins + codes[valid, j], minlength=self.bins ** 2)
+            return counts.reshape(self.bins, self.bins)
+
+        pairs = [(i, j) for i in range(values.shape[1]) for j in range(i)]
+        if self.n_jobs and self.n_jobs > 1:
+            with ThreadPoolExecutor(max_workers=self.n_jobs) as executor:
+                pair_counts = list(executor.map(count_pair, pairs))
+        else:
+            pair_counts = [count_pair(pair) for pair in pairs]
+        diagonal_counts = [
+            np.bincount(codes[codes[:, i] >= 0, i], minlength=self.bins) for i in range(values.shape[1])
+        ]
+        return numeric.columns, edges, diagonal_counts, dict(zip(pairs, pair_counts))
+
+    def _binned_pair_plot(self):
+        columns, edges, diagonal_counts, pair_counts = self.binned_pair_counts()
+        k = len(columns)
+        fig, axes = plt.subplots(k, k, figsize=(2.5 * k, 2.5 * k), squeeze=False)
+        for i in range(k):
+            for j in range(k):
+                ax = axes[i, j]
+                if j > i:
+                    # corner layout like sns.pairplot(corner=True)
+                    ax.remove()
+                    continue
+                if i == j:
+                    ax.stairs(diagonal_counts[i], edges[i], fill=True)
+                else:
+                    # row i is the y axis, column j the x axis
+                    ax.pcolormesh(edges[j], edges[i], np.ma.masked_equal(pair_counts[(i, j)], 0), cmap="viridis")
+                if i == k - 1:
+                    ax.set_xlabel(columns[j])
+                if j == 0:
+                    ax.set_ylabel(columns[i])
+        return fig
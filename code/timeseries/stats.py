@@ -1,6 +1,11 @@
+import copy
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
 import numpy as np
+import pandas as pd
 from scipy.stats import chi2
-from statsmodels.stats.diagnostic import acorr_ljungbox
+from statsmodels.tsa.stattools import adfuller
 
 
 # Helper Functions
@@ -11,29 +16,286 @@ def auto_covariance(series, h):
     return np.dot(series_centered[:(n - h)], series_centered[h:]) / (n - h)
 
 
+def auto_covariance_fft(panel, nlags=None, adjusted=True):
+    # autocovariances for lags 0..nlags of a series, or of every row of a 2-D panel of equal-length series,
+    # computed for all lags at once from one FFT in O(n log n). adjusted divides lag h by (n - h) like
+    # auto_covariance, otherwise every lag is divided by n
+    x = np.atleast_2d(np.asarray(panel, dtype=float))
+    n = x.shape[1]
+    nlags = n - 1 if nlags is None else min(nlags, n - 1)
+    centered = x - x.mean(axis=1, keepdims=True)
+    # zero-pad to at least 2n - 1 so the circular correlation equals the linear one
+    nfft = 1 << int(np.ceil(np.log2(max(2 * n - 1, 1))))
+    spectrum = np.fft.rfft(centered, n=nfft, axis=1)
+    acov = np.fft.irfft(spectrum.real ** 2 + spectrum.imag ** 2, n=nfft, axis=1)[:, :nlags + 1]
+    if adjusted:
+        acov /= n - np.arange(nlags + 1)
+    else:
+        acov /= n
+    return acov if np.ndim(panel) > 1 else acov[0]
+
+
+def auto_correlation_fft(panel, nlags=None, adjusted=False):
+    acov = auto_covariance_fft(panel, nlags=nlags, adjusted=adjusted)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return acov / acov[..., :1]
+
+
 # INDEPENDENCE TESTING
 def acorr_chi2_test(series, lags, alpha=0.05):
-    n = len(series)
+    # series can be a single series or a 2-D panel with one series per row, then every output is an array
+    n = np.shape(series)[-1]
     quantile = chi2.ppf(q=1-alpha, df=lags)
-    sum_of_autocov = 0
+    acov = auto_covariance_fft(series, nlags=lags)
 
-    for lag in range(1, lags + 1):
-        sum_of_autocov += auto_covariance(series, lag)
+    test_statistic = n * acov[..., 1:].sum(axis=-1) / (acov[..., 0] ** 2)
+    reject_h0 = test_statistic > quantile
 
-    test_statistic = n * sum_of_autocov / (auto_covariance(series, 0) ** 2)
+    return quantile, test_statistic, reject_h0
 
-    if test_statistic > quantile:
-        reject_h0 = True
-    else:
-        reject_h0 = False
 
-    return quantile, test_statistic, reject_h0
+def acorr_ljungbox_test(series, lags=10, boxpierce=False):
+    # ljung-box (and optionally box-pierce) statistics and p-values for lags 1..lags, computed from the FFT
+    # autocorrelations of a series or of every row of a 2-D panel
+    n = np.shape(series)[-1]
+    lag_range = np.arange(1, lags + 1)
+    acf_squared = auto_correlation_fft(series, nlags=lags)[..., 1:] ** 2
 
+    lb_value = n * (n + 2) * np.cumsum(acf_squared / (n - lag_range), axis=-1)
+    lb_pvalue = chi2.sf(lb_value, lag_range)
+    if boxpierce:
+        bp_value = n * np.cumsum(acf_squared, axis=-1)
+        bp_pvalue = chi2.sf(bp_value, lag_range)
+        return lb_value, lb_pvalue, bp_value, bp_pvalue
+    return lb_value, lb_pvalue
 
-def acorr_ljungbox_test(series, **kwargs):
-    results = acorr_ljungbox(series, **kwargs)
-    return results
+
+# ONLINE STATISTICS
+class OnlineAutocovariance:
+    # streaming mean, variance and lag 1..max_lag autocovariances with constant memory and O(max_lag) work per
+    # observation. mean and variance use welford updates; the lag products are accumulated around the first
+    # observation (shifted data) and re-centred on the running mean when read, using the first and last
+    # max_lag observations. accumulators of consecutive segments can be merged
+
+    def __init__(self, max_lag=10):
+        self.max_lag = max_lag
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.shift = None
+        self.sum_y = 0.0
+        self.lag_products = np.zeros(max_lag + 1)
+        self.head = []
+        self.tail = deque(maxlen=max_lag)
+
+    def update(self, new_obs):
+        for x in np.atleast_1d(np.asarray(new_obs, dtype=float)):
+            self._update(x)
+        return self
+
+    def _update(self, x):
+        if self.n == 0:
+            self.shift = x
+        y = x - self.shift
+        if self.tail:
+            # tail[-k] is the observation k steps back
+            recent = np.fromiter(reversed(self.tail), dtype=float, count=len(self.tail))
+            self.lag_products[1:len(recent) + 1] += y * recent
+        self.lag_products[0] += y * y
+        self.sum_y += y
+        if len(self.head) < self.max_lag:
+            self.head.append(y)
+        self.tail.append(y)
+
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (x - self.mean)
+
+    @property
+    def variance(self):
+        return self.m2 / self.n if self.n else np.nan
+
+    def auto_covariance(self, adjusted=True):
+        # autocovariances for lags 0..max_lag around the running mean, equal to auto_covariance_fft on the
+        # full series; lags not yet observed are NaN
+        lags = np.arange(self.max_lag + 1)
+        counts = self.n - lags
+        acov = np.full(self.max_lag + 1, np.nan)
+        if self.n == 0:
+            return acov
+        observed = counts > 0
+        head_sums = np.concatenate(([0.0], np.cumsum(self.head)))
+        tail_sums = np.concatenate(([0.0], np.cumsum(list(reversed(self.tail)))))
+        index = np.minimum(lags, len(self.head))
+        # sums of y_t over t >= k and over t < n - k
+        sum_from_lag = self.sum_y - head_sums[index]
+        sum_to_lag = self.sum_y - tail_sums[index]
+        mean_y = self.sum_y / self.n
+        centered_products = self.lag_products - mean_y * (sum_from_lag + sum_to_lag) + counts * mean_y ** 2
+        centered_products[0] = self.m2
+        divisor = counts if adjusted else self.n
+        with np.errstate(invalid='ignore', divide='ignore'):
+            acov[observed] = (centered_products / divisor)[observed]
+        return acov
+
+    def auto_correlation(self, adjusted=False):
+        acov = self.auto_covariance(adjusted=adjusted)
+        return acov / acov[0]
+
+    def acorr_chi2_test(self, lags=None, alpha=0.05):
+        # same statistic as acorr_chi2_test on every observation seen so far
+        lags = self.max_lag if lags is None else lags
+        if lags > self.max_lag:
+            raise ValueError(f'lags must not exceed max_lag ({self.max_lag})')
+        quantile = chi2.ppf(q=1-alpha, df=lags)
+        acov = self.auto_covariance()
+        test_statistic = self.n * np.sum(acov[1:lags + 1]) / (acov[0] ** 2)
+        return quantile, test_statistic, test_statistic > quantile
+
+    def merge(self, other):
+        # append the accumulator of the segment that directly follows this one, e.g. from a parallel worker
+        if other.max_lag != self.max_lag:
+            raise ValueError('only accumulators with the same max_lag can be merged')
+        if other.n == 0:
+            return self
+        if self.n == 0:
+            self.__dict__.update(copy.deepcopy(other.__dict__))
+            return self
+
+        lags = np.arange(self.max_lag + 1)
+        # re-express the other segment around this accumulator's shift
+        d = other.shift - self.shift
+        other_counts = other.n - lags
+        other_observed = other_counts > 0
+        other_index = np.minimum(lags, len(other.head))
+        other_from_lag = other.sum_y - np.concatenate(([0.0], np.cumsum(other.head)))[other_index]
+        other_to_lag = other.sum_y - np.concatenate(([0.0], np.cumsum(list(reversed(other.tail)))))[other_index]
+        other_products = np.where(
+            other_observed,
+            other.lag_products + d * (other_from_lag + other_to_lag) + other_counts * d ** 2,
+            0.0
+        )
+
+        # products of pairs straddling the boundary: the start of other with the end of self
+        other_head = np.asarray(other.head) + d
+        self_tail = np.asarray(self.tail)
+        cross_products = np.zeros(self.max_lag + 1)
+        for lag in range(1, self.max_lag + 1):
+            j = np.arange(min(lag, len(other_head)))
+            steps_back = lag - j
+            keep = steps_back <= len(self_tail)
+            cross_products[lag] = np.dot(other_head[j[keep]], self_tail[-steps_back[keep]])
+
+        self.lag_products = self.lag_products + other_products + cross_products
+        self.sum_y += other.sum_y + other.n * d
+        self.head = (self.head + list(other_head))[:self.max_lag]
+        self.tail.extend(np.asarray(other.tail) + d)
+
+        n = self.n + other.n
+        delta = other.mean - self.mean
+        self.mean += delta * other.n / n
+        self.m2 += other.m2 + delta ** 2 * self.n * other.n / n
+        self.n = n
+        return self
 
 
 # STATIONARITY TESTING
+# level-stationarity KPSS critical values (Kwiatkowski et al. 1992, table 1) and their p-values
+KPSS_LEVEL_CRITICAL_VALUES = np.array([0.347, 0.463, 0.574, 0.739])
+KPSS_LEVEL_PVALUES = np.array([0.10, 0.05, 0.025, 0.01])
+
+
+def kpss_level_test(panel, nlags=None, acov=None):
+    # vectorized KPSS test for level stationarity of a series or of every row of a panel. the long-run
+    # variance uses bartlett weights on the biased autocovariances, which can be passed in when already computed
+    x = np.atleast_2d(np.asarray(panel, dtype=float))
+    n = x.shape[1]
+    nlags = int(np.ceil(12 * (n / 100) ** 0.25)) if nlags is None else nlags
+    nlags = min(nlags, n - 1)
+    if acov is None:
+        acov = auto_covariance_fft(x, nlags=nlags, adjusted=False)
+    acov = np.atleast_2d(acov)
+
+    partial_sums = np.cumsum(x - x.mean(axis=1, keepdims=True), axis=1)
+    eta = np.sum(partial_sums ** 2, axis=1) / n ** 2
+    weights = 1 - np.arange(1, nlags + 1) / (nlags + 1)
+    long_run_variance = acov[:, 0] + 2 * np.dot(acov[:, 1:nlags + 1], weights)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        test_statistic = eta / long_run_variance
+    # p-values are interpolated in the table and bounded by its range, like statsmodels
+    p_value = np.interp(test_statistic, KPSS_LEVEL_CRITICAL_VALUES, KPSS_LEVEL_PVALUES)
+    if np.ndim(panel) > 1:
+        return test_statistic, p_value
+    return test_statistic[0], p_value[0]
+
+
+def _adf_test_rows(rows, adf_kwargs):
+    results = []
+    for row in rows:
+        adf_statistic, p_value, used_lags = adfuller(row, **adf_kwargs)[:3]
+        results.append((adf_statistic, p_value, used_lags))
+    return results
+
+
+def stationarity_test_batch(panel, lags=10, alpha=0.05, series_ids=None, n_jobs=None, min_length=20,
+                            unit_root_threshold=0.99, kpss_lags=None, adf_kwargs=None):
+    # run ljung-box, kpss and adf over every row of a panel of equal-length series and return one tidy frame.
+    # ljung-box, kpss and the pre-screens share one FFT autocovariance computation; series that fail a cheap
+    # pre-screen (constant, too short, lag-1 autocorrelation above unit_root_threshold) skip kpss and adf.
+    # adf runs in a process pool when n_jobs is set
+    x = np.atleast_2d(np.asarray(panel, dtype=float))
+    num_series, n = x.shape
+    series_ids = np.arange(num_series) if series_ids is None else np.asarray(series_ids)
+    kpss_lags = min(int(np.ceil(12 * (n / 100) ** 0.25)) if kpss_lags is None else kpss_lags, n - 1)
+    lags = min(lags, n - 1)
+    adf_kwargs = adf_kwargs or {'autolag': 'AIC'}
+
+    acov = auto_covariance_fft(x, nlags=max(lags, kpss_lags), adjusted=False)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        acf = acov / acov[:, :1]
+
+    prescreen = np.full(num_series, 'passed', dtype=object)
+    if n > 1:
+        prescreen[acf[:, 1] >= unit_root_threshold] = 'near_unit_root'
+    prescreen[n < min_length] = 'too_short'
+    prescreen[acov[:, 0] == 0] = 'constant'
+    # a single observation has no lag-1 autocorrelation and no variance, whatever min_length is
+    prescreen[n < 2] = 'too_short'
+    passed = prescreen == 'passed'
 
+    results = pd.DataFrame({'series_id': series_ids, 'prescreen': prescreen})
+
+    results['lb_statistic'] = np.nan
+    results['lb_pvalue'] = np.nan
+    if lags > 0:
+        lag_range = np.arange(1, lags + 1)
+        lb_statistic = n * (n + 2) * np.sum(acf[:, 1:lags + 1] ** 2 / (n - lag_range), axis=1)
+        results['lb_statistic'] = lb_statistic
+        results['lb_pvalue'] = chi2.sf(lb_statistic, lags)
+
+    results['kpss_statistic'] = np.nan
+    results['kpss_pvalue'] = np.nan
+    if passed.any():
+        kpss_statistic, kpss_pvalue = kpss_level_test(x[passed], nlags=kpss_lags, acov=acov[passed])
+        results.loc[passed, 'kpss_statistic'] = kpss_statistic
+        results.loc[passed, 'kpss_pvalue'] = kpss_pvalue
+
+    results['adf_statistic'] = np.nan
+    results['adf_pvalue'] = np.nan
+    results['adf_lags'] = np.nan
+    if passed.any():
+        rows = x[passed]
+        if n_jobs and n_jobs > 1:
+            row_chunks = np.array_split(rows, min(n_jobs * 4, len(rows)))
+            with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+                chunk_results = executor.map(_adf_test_rows, row_chunks, [adf_kwargs] * len(row_chunks))
+                adf_results = [result for chunk_result in chunk_results for result in chunk_result]
+        else:
+            adf_results = _adf_test_rows(rows, adf_kwargs)
+        results.loc[passed, ['adf_statistic', 'adf_pvalue', 'adf_lags']] = np.array(adf_results, dtype=float)
+
+    # stationary when adf rejects a unit root and kpss does not reject stationarity. kpss p-values are capped at
+    # 0.10, so the comparison must include alpha itself
+    results['is_stationary'] = passed & (results['adf_pvalue'] < alpha) & (results['kpss_pvalue'] >= alpha)
+    return results
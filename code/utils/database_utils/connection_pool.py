@@ -0,0 +1,114 @@
+import logging
+import os
+import threading
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import pool
+from pymongo import MongoClient
+
+from utils.database_utils.database_config import mongodb_config, postgres_config
+
+logging.basicConfig(level=logging.INFO)
+
+
+class PostgresConnectionPool(object):
+    # thread-safe pool of connections to one database. checkout blocks while max_connections are in use and
+    # replaces connections that fail the health check
+
+    def __init__(self, config, min_connections=1, max_connections=10, health_check=True):
+        self.pool = pool.ThreadedConnectionPool(min_connections, max_connections, **config)
+        self.health_check = health_check
+        self._semaphore = threading.BoundedSemaphore(max_connections)
+
+    @contextmanager
+    def connection(self, autocommit=True):
+        connection = self._checkout(autocommit)
+        try:
+            yield connection
+            if not autocommit:
+                connection.commit()
+        except Exception:
+            if not autocommit and not connection.closed:
+                connection.rollback()
+            raise
+        finally:
+            self.pool.putconn(connection, close=bool(connection.closed))
+            self._semaphore.release()
+
+    def _checkout(self, autocommit):
+        self._semaphore.acquire()
+        try:
+            # one retry so a connection dropped by the server is replaced transparently
+            for attempt in range(2):
+                connection = self.pool.getconn()
+                if self._is_healthy(connection, autocommit):
+                    return connection
+                logging.info('discarding unhealthy postgres connection')
+                self.pool.putconn(connection, close=True)
+            raise psycopg2.OperationalError('no healthy connection available')
+        except Exception:
+            self._semaphore.release()
+            raise
+
+    def _is_healthy(self, connection, autocommit):
+        if connection.closed:
+            return False
+        try:
+            connection.autocommit = autocommit
+            if self.health_check:
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT 1')
+                if not autocommit:
+                    connection.rollback()
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            return False
+        return True
+
+    def close(self):
+        self.pool.closeall()
+
+
+# pools are shared per process and per database; connections must not be shared across forked processes
+_postgres_pools = {}
+_mongo_clients = {}
+_registry_lock = threading.Lock()
+
+
+def get_postgres_pool(db_name=None, min_connections=1, max_connections=10, health_check=True):
+    key = (os.getpid(), db_name)
+    with _registry_lock:
+        if key not in _postgres_pools:
+            config = postgres_config()
+            if db_name:
+                config['database'] = db_name
+            logging.info(f'Creating PostgreSQL connection pool for database {db_name}...')
+            _postgres_pools[key] = PostgresConnectionPool(
+                config,
+                min_connections=min_connections,
+                max_connections=max_connections,
+                health_check=health_check
+            )
+        return _postgres_pools[key]
+
+
+def get_mongo_client(min_pool_size=0, max_pool_size=100):
+    # MongoClient keeps its own thread-safe connection pool, so one client per process is shared by all handlers
+    key = os.getpid()
+    with _registry_lock:
+        if key not in _mongo_clients:
+            logging.info('Connecting to MongoDB database...')
+            _mongo_clients[key] = MongoClient(
+                mongodb_config(), minPoolSize=min_pool_size, maxPoolSize=max_pool_size
+            )
+        return _mongo_clients[key]
+
+
+def close_all_pools():
+    with _registry_lock:
+        for postgres_pool in _postgres_pools.values():
+            postgres_pool.close()
+        for client in _mongo_clients.values():
+            client.close()
+        _postgres_pools.clear()
+        _mongo_clients.clear()
@@ -1,44 +1,86 @@
 import logging
+import os
+import threading
+import time
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 
 import pandas as pd
 
-from pymongo import MongoClient
+from pymongo import ASCENDING, InsertOne, ReplaceOne
+from pymongo.errors import BulkWriteError, OperationFailure, PyMongoError
 
 logging.basicConfig(level=logging.INFO)
 
 
-from utils.database_utils.database_config import mongodb_config
+from utils.database_utils.connection_pool import get_mongo_client
+
+
+BulkWriteSummary = namedtuple(
+    'BulkWriteSummary',
+    ['inserted_count', 'updated_count', 'failed_count', 'seconds', 'documents_per_second', 'errors', 'index_error'],
+    defaults=(None,)
+)
+
+# upsert indexes already ensured in this process, (pid, database, collection, key) -> index error or None
+_upsert_indexes = {}
+_upsert_index_lock = threading.Lock()
 
 
 class MongoDBHandler(object):
-    _instance = None
-
-    def __new__(cls, *args, **kwargs):
-        if cls._instance is None:
-            # create new instance if instance does not exist
-            cls._instance = object.__new__(cls)
-            # read in postgres config
-            config_string = mongodb_config()
-            # try connection
-            try:
-                logging.info('Connecting to MongoDB database...')
-                client = MongoDBHandler._instance.client = MongoClient(config_string)
-            except Exception as error:
-                logging.info(f'Error: connection not established {error}')
-                MongoDBHandler._instance = None
-            else:
-                logging.info(f'connection established')
-        return cls._instance
+    # all handlers share the per-process client and its connection pool; each handler binds its own database
 
-    def __init__(self, db_name=None):
-        self.client = self._instance.client
+    def __init__(self, db_name=None, min_pool_size=0, max_pool_size=100):
+        self.client = get_mongo_client(min_pool_size=min_pool_size, max_pool_size=max_pool_size)
         self.db_name = db_name
-        if self.db_name:
-            self.db = self.client[self.db_name]
+        self.db = self.client[self.db_name] if self.db_name else None
+
+    def ping(self):
+        try:
+            self.client.admin.command('ping')
+        except PyMongoError as error:
+            logging.info(f'Error: connection not established {error}')
+            return False
+        return True
 
     def query(self, query_string):
         return query_string
 
+    def find_chunks(self, collection_name, filter=None, projection=None, batch_size=10000, unwind=None):
+        # stream matching documents as dataframes of batch_size rows. with unwind (e.g. 'review_list') the array
+        # is unwound server-side and each element becomes a row, projected with the same projection
+        collection = self.db[collection_name]
+        if unwind:
+            unwind_projection = {'_id': 0}
+            if projection:
+                unwind_projection.update({f'{unwind}.{field}': value for field, value in projection.items()})
+            else:
+                unwind_projection[unwind] = 1
+            pipeline = [
+                {'$match': filter or {}},
+                {'$project': unwind_projection},
+                {'$unwind': f'${unwind}'},
+                {'$replaceRoot': {'newRoot': f'${unwind}'}}
+            ]
+            cursor = collection.aggregate(pipeline, batchSize=batch_size, allowDiskUse=True)
+        else:
+            cursor = collection.find(filter or {}, projection).batch_size(batch_size)
+
+        with cursor:
+            documents = list(islice(cursor, batch_size))
+            while documents:
+                yield pd.DataFrame.from_records(documents)
+                documents = list(islice(cursor, batch_size))
+
+    def find_dataframe(self, collection_name, filter=None, projection=None, batch_size=10000, unwind=None):
+        chunks = list(
+            self.find_chunks(collection_name, filter=filter, projection=projection, batch_size=batch_size, unwind=unwind)
+        )
+        if not chunks:
+            return pd.DataFrame()
+        return pd.concat(chunks, ignore_index=True, sort=False, copy=False)
+
     def list_databases(self):
         return self.client.list_database_names()
 
@@ -65,13 +107,135 @@ class MongoDBHandler(object):
     def drop_collection(self, collection_name):
         self.db[collection_name].drop()
 
-    def insert_values(self, collection_name, data):
+    def insert_values(self, collection_name, data, **kwargs):
+        return self.bulk_write(collection_name, data, **kwargs)
+
+    def bulk_write(self, collection_name, data, batch_size=1000, max_workers=1, upsert_key=None, ordered=False,
+                   max_errors=100):
+        # writes data in batches of batch_size documents from a pool of max_workers threads. with an
+        # upsert_key (field name or list of field names) documents replace their previous version, so reruns
+        # are idempotent
+        collection = self.db[collection_name]
+        index_error = None
+        if upsert_key:
+            upsert_key = [upsert_key] if isinstance(upsert_key, str) else list(upsert_key)
+            index_error = self._ensure_upsert_index(collection, upsert_key)
+
+        start = time.time()
+        batch_results = []
+        if max_workers > 1:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                # keep a bounded number of batches in flight so the input is never materialized at once
+                pending = deque()
+                for batch in self._iter_batches(data, batch_size):
+                    if len(pending) >= 2 * max_workers:
+                        batch_results.append(pending.popleft().result())
+                    pending.append(executor.submit(self._write_batch, collection, batch, upsert_key, ordered))
+                batch_results += [future.result() for future in pending]
+        else:
+            batch_results = [
+                self._write_batch(collection, batch, upsert_key, ordered)
+                for batch in self._iter_batches(data, batch_size)
+            ]
+        seconds = time.time() - start
+
+        inserted_count = sum(result['inserted'] for result in batch_results)
+        updated_count = sum(result['updated'] for result in batch_results)
+        failed_count = sum(result['failed'] for result in batch_results)
+        errors = [error for result in batch_results for error in result['errors']][:max_errors]
+        if failed_count:
+            logging.error(f'{failed_count} documents failed to write to {collection_name}: {errors[:1]}')
+        return BulkWriteSummary(
+            inserted_count=inserted_count,
+            updated_count=updated_count,
+            failed_count=failed_count,
+            seconds=seconds,
+            documents_per_second=(inserted_count + updated_count) / seconds if seconds else None,
+            errors=errors,
+            index_error=index_error
+        )
+
+    def drop_duplicate_documents(self, collection_name, key):
+        # keeps the most recently inserted document of every key and deletes the others, so that the unique upsert
+        # index can be built on collections filled before upserts were used
+        key = [key] if isinstance(key, str) else list(key)
+        pipeline = [
+            {'$sort': {'_id': 1}},
+            {'$group': {'_id': {field: f'${field}' for field in key}, 'ids': {'$push': '$_id'}, 'count': {'$sum': 1}}},
+            {'$match': {'count': {'$gt': 1}}}
+        ]
+        groups = self.db[collection_name].aggregate(pipeline, allowDiskUse=True)
+        duplicate_ids = [_id for group in groups for _id in group['ids'][:-1]]
+        deleted_count = 0
+        for start in range(0, len(duplicate_ids), 10000):
+            deleted_count += self.db[collection_name].delete_many(
+                {'_id': {'$in': duplicate_ids[start:start + 10000]}}
+            ).deleted_count
+        logging.info(f'{collection_name}: {deleted_count} duplicate documents deleted')
+        # the next bulk_write tries the unique index again
+        with _upsert_index_lock:
+            _upsert_indexes.pop((os.getpid(), self.db.name, collection_name, tuple(key)), None)
+        return deleted_count
+
+    @staticmethod
+    def _ensure_upsert_index(collection, upsert_key):
+        # a unique index, so upserts racing on the same key cannot insert duplicates. it is created once per
+        # collection and process rather than for every batch or streamed chunk. collections that already hold
+        # duplicate keys fall back to a plain index and report the error, see drop_duplicate_documents
+        index_key = (os.getpid(), collection.database.name, collection.name, tuple(upsert_key))
+        with _upsert_index_lock:
+            if index_key not in _upsert_indexes:
+                keys = [(key, ASCENDING) for key in upsert_key]
+                for index_name, index_info in collection.index_information().items():
+                    # a plain index on the same key, from earlier writes or a failed attempt, blocks the unique one
+                    if [tuple(field) for field in index_info['key']] == keys and not index_info.get('unique'):
+                        collection.drop_index(index_name)
+                try:
+                    collection.create_index(keys, unique=True)
+                    _upsert_indexes[index_key] = None
+                except OperationFailure as error:
+                    index_error = f'unique index on {upsert_key} could not be created: {error}'
+                    logging.error(
+                        f'{collection.name}: {index_error}. reruns are not guaranteed to be idempotent until '
+                        f'duplicates are removed with drop_duplicate_documents'
+                    )
+                    collection.create_index(keys)
+                    _upsert_indexes[index_key] = index_error
+            return _upsert_indexes[index_key]
+
+    @staticmethod
+    def _iter_batches(data, batch_size):
         if isinstance(data, pd.DataFrame):
-            data = data.to_dict('records')
+            # convert one slice at a time instead of the whole frame
+            for start in range(0, len(data), batch_size):
+                yield data.iloc[start:start + batch_size].to_dict('records')
+        else:
+            iterator = iter(data)
+            batch = list(islice(iterator, batch_size))
+            while batch:
+                yield batch
+                batch = list(islice(iterator, batch_size))
+
+    @staticmethod
+    def _write_batch(collection, batch, upsert_key, ordered):
+        if upsert_key:
+            operations = [
+                ReplaceOne({key: document.get(key) for key in upsert_key}, document, upsert=True)
+                for document in batch
+            ]
+        else:
+            operations = [InsertOne(document) for document in batch]
         try:
-            self.db[collection_name].insert_many(data)
-        except Exception as e:
-            logging.info(f'error: {e}')
-
-    def __del__(self):
-        self.client.close()
+            details = collection.bulk_write(operations, ordered=ordered).bulk_api_result
+        except BulkWriteError as error:
+            details = error.details
+        except PyMongoError as error:
+            return {'inserted': 0, 'updated': 0, 'failed': len(batch), 'errors': [{'errmsg': str(error)}]}
+        write_errors = details.get('writeErrors', [])
+        return {
+            'inserted': details.get('nInserted', 0) + details.get('nUpserted', 0),
+            # matched rather than modified, so documents replaced by an identical version on a rerun still count
+            'updated': details.get('nMatched', 0),
+            'failed': len(write_errors),
+            'errors': [{'index': error.get('index'), 'errmsg': error.get('errmsg')} for error in write_errors]
+        }
@@ -0,0 +1,59 @@
+import time
+
+import numpy as np
+import pandas as pd
+
+from utils.database_utils.postgres_handler import PostgresHandler
+
+
+TABLE_SCHEMA = [
+    {'field_name': 'id', 'field_type': 'BIGINT', 'is_primary_key': True, 'is_nullable': False},
+    {'field_name': 'value', 'field_type': 'DOUBLE PRECISION', 'is_primary_key': False, 'is_nullable': True},
+    {'field_name': 'label', 'field_type': 'TEXT', 'is_primary_key': False, 'is_nullable': True},
+]
+
+
+def make_rows(num_rows, random_state=0):
+    rng = np.random.RandomState(random_state)
+    return pd.DataFrame({
+        'id': np.arange(num_rows),
+        'value': rng.normal(size=num_rows),
+        'label': rng.choice(['a', 'b', 'c'], size=num_rows)
+    })
+
+
+def run_benchmark(row_counts=(10000, 100000, 500000), table_name='copy_benchmark', db_name=None):
+    # compares rows per second of the mogrify-based insert_values with the COPY based copy_values
+    postgres_handler = PostgresHandler(db_name=db_name)
+    column_names = [field['field_name'] for field in TABLE_SCHEMA]
+    methods = {
+        'insert_values': lambda df: postgres_handler.insert_values(
+            table_name, column_names, df.itertuples(index=False, name=None)
+        ),
+        'copy_values': lambda df: postgres_handler.copy_values(table_name, column_names, df),
+        'copy_values_merge': lambda df: postgres_handler.copy_values(
+            table_name, column_names, df, conflict_columns=['id']
+        ),
+    }
+
+    results = []
+    for num_rows in row_counts:
+        df = make_rows(num_rows)
+        for method_name, method in methods.items():
+            postgres_handler.drop_table(table_name)
+            postgres_handler.create_table(table_name, TABLE_SCHEMA)
+            start = time.perf_counter()
+            method(df)
+            elapsed = time.perf_counter() - start
+            results.append({
+                'method': method_name,
+                'num_rows': num_rows,
+                'seconds': elapsed,
+                'rows_per_second': num_rows / elapsed
+            })
+    postgres_handler.drop_table(table_name)
+    return pd.DataFrame(results).pivot(index='num_rows', columns='method', values='rows_per_second')
+
+
+if __name__ == '__main__':
+    print(run_benchmark())
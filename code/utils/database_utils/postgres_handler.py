@@ -1,57 +1,115 @@
+import io
 import logging
+import uuid
+from itertools import islice
 logging.basicConfig(level=logging.INFO)
 
-import psycopg2
-
-from utils.database_utils.database_config import postgres_config
+import numpy as np
+import pandas as pd
+
+from utils.database_utils.connection_pool import get_postgres_pool
+
+
+class CsvChunkStream(object):
+    # file-like object over an iterator of csv text chunks, consumed by cursor.copy_expert so the full payload
+    # is never built in memory
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.chunk = ''
+        self.position = 0
+
+    def read(self, size=-1):
+        if self.position >= len(self.chunk):
+            self.chunk = next(self.chunks, '')
+            self.position = 0
+        if size is None or size < 0:
+            data = self.chunk[self.position:] + ''.join(self.chunks)
+            self.chunk, self.position = '', 0
+            return data
+        data = self.chunk[self.position:self.position + size]
+        self.position += len(data)
+        return data
+
+
+# postgres type oid -> pandas dtype for columns read back into dataframes
+POSTGRES_DTYPES = {
+    16: 'boolean',
+    20: 'Int64',
+    21: 'Int64',
+    23: 'Int64',
+    700: 'float64',
+    701: 'float64',
+    1700: 'float64',
+    1082: 'datetime64[ns]',
+    1114: 'datetime64[ns]',
+    1184: 'datetime64[ns, UTC]',
+}
 
 
 class PostgresHandler(object):
-    _instance = None
-
-    def __new__(cls, *args, **kwargs):
-        if cls._instance is None:
-            # create new instance if instance does not exist
-            cls._instance = object.__new__(cls)
-            # read in postgres config
-            config = postgres_config()
-            if kwargs:
-                config['database'] = kwargs['db_name']
-            # try connection
-            try:
-                logging.info('Connecting to PostgreSQL database...')
-                connection = PostgresHandler._instance.connection = psycopg2.connect(**config)
-                cursor = PostgresHandler._instance.cursor = connection.cursor()
-                PostgresHandler._instance.connection.autocommit = True
-                cursor.execute('SELECT VERSION()')
-                db_version = cursor.fetchone()
-            except Exception as error:
-                logging.info(f'Error: connection not established {error}')
-                PostgresHandler._instance = None
-            else:
-                logging.info(f'connection established\n{db_version[0]}')
-        return cls._instance
+    # handlers are cheap; each one checks connections out of the shared pool for its database per call
 
-    def __init__(self, db_name=None):
-        self.connection = self._instance.connection
-        self.cursor = self._instance.cursor
+    def __init__(self, db_name=None, min_connections=1, max_connections=10, health_check=True):
         self.db_name = db_name
-
-    def query(self, query_string):
+        self.pool = get_postgres_pool(
+            db_name,
+            min_connections=min_connections,
+            max_connections=max_connections,
+            health_check=health_check
+        )
+
+    def connection(self, autocommit=True):
+        return self.pool.connection(autocommit=autocommit)
+
+    def query(self, query_string, params=None):
+        # returns the fetched rows for statements that produce them, otherwise the affected row count
         try:
-            result = self.cursor.execute(query_string)
+            with self.connection() as connection, connection.cursor() as cursor:
+                cursor.execute(query_string, params)
+                if cursor.description is not None:
+                    return cursor.fetchall()
+                return cursor.rowcount
         except Exception as error:
             logging.info(f'error executing query {query_string}: {error}')
-        else:
-            return result
+
+    def query_chunks(self, query_string, params=None, chunk_size=100000, itersize=10000):
+        # stream the result through a named server-side cursor, fetching itersize rows per round trip and
+        # yielding a dataframe every chunk_size rows. an empty result yields one empty dataframe that keeps the
+        # column names and dtypes of the result
+        with self.connection(autocommit=False) as connection:
+            with connection.cursor(name=f'query_chunks_{uuid.uuid4().hex}') as cursor:
+                cursor.itersize = itersize
+                cursor.execute(query_string, params)
+                rows = list(islice(cursor, chunk_size))
+                if not rows:
+                    yield self._rows_to_dataframe(rows, cursor.description)
+                while rows:
+                    yield self._rows_to_dataframe(rows, cursor.description)
+                    rows = list(islice(cursor, chunk_size))
+
+    def query_dataframe(self, query_string, params=None, chunk_size=100000, itersize=10000):
+        chunks = list(self.query_chunks(query_string, params=params, chunk_size=chunk_size, itersize=itersize))
+        if len(chunks) == 1:
+            return chunks[0]
+        return pd.concat(chunks, ignore_index=True, copy=False)
+
+    @staticmethod
+    def _rows_to_dataframe(rows, description):
+        df = pd.DataFrame.from_records(rows, columns=[column.name for column in description])
+        for column in description:
+            dtype = POSTGRES_DTYPES.get(column.type_code)
+            if dtype == 'datetime64[ns, UTC]':
+                df[column.name] = pd.to_datetime(df[column.name], utc=True)
+            elif dtype:
+                df[column.name] = df[column.name].astype(dtype)
+        return df
 
     def list_databases(self):
-        self.query("SELECT datname FROM pg_database;")
-        return [db[0] for db in self.cursor]
+        return [db[0] for db in self.query("SELECT datname FROM pg_database;") or []]
 
     def create_database(self, db_name):
-        self.query(f"SELECT 1 FROM pg_catalog.pg_database WHERE datname = '{db_name}'")
-        exists = self.cursor.fetchone()
+        exists = self.query(f"SELECT 1 FROM pg_catalog.pg_database WHERE datname = '{db_name}'")
         if not exists:
             self.query(f'CREATE DATABASE {db_name}')
 
@@ -59,9 +117,9 @@ class PostgresHandler(object):
         self.query(f'DROP DATABASE IF EXISTS {db_name}')
 
     def list_tables(self):
-        self.query("""SELECT table_name FROM information_schema.tables WHERE table_schema = 'public' """)
-        if self.cursor:
-            return [table[0] for table in self.cursor.fetchall()]
+        tables = self.query("""SELECT table_name FROM information_schema.tables WHERE table_schema = 'public' """)
+        if tables:
+            return [table[0] for table in tables]
 
     def create_table(self, table_name, table_schema):
         # table schema must be list of dictionaries of the form
@@ -72,16 +130,16 @@ class PostgresHandler(object):
                 logging.info('table already exists')
                 return
 
-        query_body = ''
+        column_definitions = []
         for field_dict in table_schema:
-            query_line_end = ''
+            column_definition = "{field_name} {field_type}".format(**field_dict)
             if field_dict['is_primary_key']:
-                query_line_end += 'PRIMARY KEY,'
+                column_definition += ' PRIMARY KEY'
             else:
                 if not field_dict['is_nullable']:
-                    query_line_end += 'NOT NULL,'
-            query_body += "{field_name} {field_type} ".format(**field_dict) + query_line_end
-        query_body = query_body.rstrip(',')
+                    column_definition += ' NOT NULL'
+            column_definitions.append(column_definition)
+        query_body = ', '.join(column_definitions)
         query_string = f'''CREATE TABLE {table_name} ({query_body})'''
         self.query(query_string)
 
@@ -91,10 +149,96 @@ class PostgresHandler(object):
     def insert_values(self, table_name, column_names, data):
         column_string = str(tuple(column_names)).replace("'", "")
         insert_query_string = f'''INSERT INTO {table_name} {column_string} VALUES '''
-        data_string = b','.join(self.cursor.mogrify("%s", (val, )) for val in data).decode("utf-8")
-        insert_query_string += data_string
-        self.query(insert_query_string)
-
-    def __del__(self):
-        self.connection.close()
-        self.cursor.close()
+        with self.connection() as connection, connection.cursor() as cursor:
+            data_string = b','.join(cursor.mogrify("%s", (val, )) for val in data).decode("utf-8")
+            insert_query_string += data_string
+            cursor.execute(insert_query_string)
+            return cursor.rowcount
+
+    def copy_values(self, table_name, column_names, data, chunk_size=10000, conflict_columns=None):
+        # bulk load a dataframe or an iterator of row tuples through COPY FROM STDIN, chunk_size rows at a time.
+        # with conflict_columns the rows are copied into a staging table and merged with INSERT ... ON CONFLICT.
+        # everything runs in one transaction on one connection, since the staging table is session-local
+        column_string = ', '.join(column_names)
+        target_table = f'{table_name}_staging' if conflict_columns else table_name
+        with self.connection(autocommit=False) as connection, connection.cursor() as cursor:
+            if conflict_columns:
+                cursor.execute(
+                    f'CREATE TEMP TABLE {target_table} (LIKE {table_name} INCLUDING DEFAULTS) ON COMMIT DROP'
+                )
+
+            stream = CsvChunkStream(self._iter_csv_chunks(column_names, data, chunk_size))
+            # an explicit NULL marker, since an unquoted empty field would otherwise turn empty strings into NULL
+            cursor.copy_expert(
+                f"COPY {target_table} ({column_string}) FROM STDIN WITH (FORMAT csv, NULL '\\N')", stream
+            )
+            row_count = cursor.rowcount
+
+            if conflict_columns:
+                update_columns = [column for column in column_names if column not in conflict_columns]
+                if update_columns:
+                    update_string = ', '.join(f'{column} = EXCLUDED.{column}' for column in update_columns)
+                    conflict_action = f'DO UPDATE SET {update_string}'
+                else:
+                    conflict_action = 'DO NOTHING'
+                # a key repeated in the input can only be merged once per statement, the last copied row wins
+                conflict_string = ', '.join(conflict_columns)
+                cursor.execute(
+                    f"""INSERT INTO {table_name} ({column_string}) """
+                    f"""SELECT DISTINCT ON ({conflict_string}) {column_string} FROM {target_table} """
+                    f"""ORDER BY {conflict_string}, ctid DESC """
+                    f"""ON CONFLICT ({conflict_string}) {conflict_action}"""
+                )
+                row_count = cursor.rowcount
+        return row_count
+
+    @staticmethod
+    def _iter_csv_chunks(column_names, data, chunk_size):
+        # both paths write the same csv: nulls (None, NaN, NaT) as the unquoted marker \N, strings always quoted
+        # so empty strings and a literal \N stay strings, and integral floats without a decimal so integer columns
+        # accept them
+        if isinstance(data, pd.DataFrame):
+            data = data[list(column_names)]
+            for start in range(0, len(data), chunk_size):
+                chunk = data.iloc[start:start + chunk_size]
+                lines = None
+                for column in chunk.columns:
+                    text = PostgresHandler._format_csv_column(chunk[column])
+                    lines = text if lines is None else lines + ',' + text
+                yield '\n'.join(lines.tolist()) + '\n'
+        else:
+            iterator = iter(data)
+            rows = list(islice(iterator, chunk_size))
+            while rows:
+                yield ''.join(
+                    ','.join(PostgresHandler._format_csv_value(value) for value in row) + '\n' for row in rows
+                )
+                rows = list(islice(iterator, chunk_size))
+
+    @staticmethod
+    def _format_csv_column(series):
+        nulls = series.isnull().values
+        if pd.api.types.is_float_dtype(series):
+            values = series.values[~nulls]
+            if np.all(np.isfinite(values) & (values % 1 == 0) & (np.abs(values) < 2 ** 53)):
+                # integer columns read as float because of missing values
+                series = series.astype('Int64')
+        if pd.api.types.is_numeric_dtype(series) or pd.api.types.is_datetime64_any_dtype(series):
+            text = series.astype(str).values.astype(object)
+        else:
+            text = ('"' + series.astype(str).str.replace('"', '""', regex=False) + '"').values.astype(object)
+        text[nulls] = '\\N'
+        return text
+
+    @staticmethod
+    def _format_csv_value(value):
+        if value is None or (isinstance(value, float) and value != value) or value is pd.NaT:
+            return '\\N'
+        if isinstance(value, (bool, np.bool_)):
+            return str(bool(value))
+        if isinstance(value, (int, np.integer)):
+            return str(int(value))
+        if isinstance(value, (float, np.floating)):
+            value = float(value)
+            return str(int(value)) if value.is_integer() and abs(value) < 2 ** 53 else repr(value)
+        return '"' + str(value).replace('"', '""') + '"'